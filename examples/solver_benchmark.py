@@ -0,0 +1,56 @@
+"""Compares solve times of the relevance optimizer backends on synthetic problems.
+
+    python examples/solver_benchmark.py [features ...]
+
+Subsets of up to 5 features are sampled like RaR does, their score is the largest relevance of a random ground
+truth plus noise. The Gurobi backend is only timed if gurobipy is installed.
+"""
+import importlib.util
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from wrar.solvers import GurobiSolver, QPSolver, subset_incidence
+
+
+def relevance_problem(features, constraints, k=5, seed=0):
+  random_state = np.random.RandomState(seed)
+  columns = ['x{}'.format(i) for i in range(features)]
+  relevances = random_state.rand(features) ** 3
+
+  subsets = {}
+  for _ in range(constraints):
+    subset = tuple(sorted(random_state.choice(features, random_state.randint(1, k + 1), replace=False)))
+    subsets[tuple(columns[i] for i in subset)] = relevances[list(subset)].max() + 0.05 * random_state.rand()
+
+  scores = pd.Series(list(subsets.values()), index=pd.Index(list(subsets.keys()), tupleize_cols=False))
+  return columns, scores
+
+
+def main(feature_counts):
+  solvers = {'qp': QPSolver()}
+  if importlib.util.find_spec('gurobipy') is not None:
+    solvers['gurobi'] = GurobiSolver()
+
+  print('features constraints ' + ' '.join('{:>10}'.format(name) for name in solvers) + '  max |difference|')
+  for features in feature_counts:
+    for constraints in (1000, 5000, 20000):
+      columns, scores = relevance_problem(features, constraints)
+      times, solutions = [], []
+      for solver in solvers.values():
+        start = time.time()
+        incidence = subset_incidence(columns, list(scores.index))
+        solutions.append(solver.solve(incidence, scores.values, scores.max()))
+        times.append(time.time() - start)
+
+      difference = max(np.abs(solution - solutions[0]).max() for solution in solutions)
+      print('{:8d} {:11d} '.format(features, len(scores)) + ' '.join('{:9.3f}s'.format(t) for t in times) +
+            '  {:.2e}'.format(difference))
+
+
+if __name__ == '__main__':
+  main([int(arg) for arg in sys.argv[1:]] or [20, 100, 500])
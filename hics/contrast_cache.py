@@ -0,0 +1,99 @@
+import sys
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+
+def _sizeof(value):
+    """Rough memory footprint of a cached value in bytes
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(element) for element in value)
+    return sys.getsizeof(value)
+
+
+class ContrastCache:
+    """LRU cache in front of HiCS.calculate_contrast.
+
+    Entries are keyed by subspace, target, iterations, alpha, divergences, cost matrix and adaptive tolerance. They
+    accumulate the iteration-weighted mean of every contrast estimated for their key. A lookup is a hit once an entry
+    holds at least min_iterations slice iterations (default: the iterations of a single call, or the minimum
+    iterations of an adaptive one), before that, new estimates are added
+    to the entry. Least recently used entries are evicted once the cache holds more than max_memory bytes
+    """
+
+    def __init__(self, max_memory=64 * 2 ** 20, min_iterations=None):
+        self.max_memory = max_memory
+        self.min_iterations = min_iterations
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def empty_copy(self):
+        return ContrastCache(self.max_memory, self.min_iterations)
+
+    def key(self, contrast, features, target, cost_matrix=None):
+        if cost_matrix is None:
+            cost_key = None
+        else:
+            cost_key = (tuple(cost_matrix.columns), tuple(cost_matrix.values.ravel()))
+        # Adaptive estimates are complete after min_iterations slices already
+        if contrast.adaptive_tolerance is None:
+            iterations = contrast.iterations
+        else:
+            iterations = contrast.min_iterations
+        return (tuple(sorted(features, key=str)), target, iterations, contrast.alpha,
+                contrast.categorical_divergence.__name__, contrast.continuous_divergence.__name__, cost_key,
+                contrast.adaptive_tolerance)
+
+    def get(self, key, return_slices=False):
+        """Cached entry for key, or None if it has not accumulated enough iterations (or lacks requested slices)
+        """
+        entry = self.entries.get(key)
+        min_iterations = self.min_iterations if self.min_iterations is not None else key[2]
+
+        if entry is None or entry['iterations'] < min_iterations or (return_slices and entry['slices'] is None):
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def add(self, key, score, iterations, slices=None, binary_scores=None):
+        """Adds a new estimate over iterations slices to the entry of key and returns the updated entry
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = {'score': score, 'iterations': iterations, 'slices': slices, 'binary': binary_scores}
+        else:
+            self.memory -= entry['size']
+            total = entry['iterations'] + iterations
+            entry['score'] = (entry['iterations'] * entry['score'] + iterations * score) / total
+            if binary_scores is not None and entry['binary'] is not None:
+                entry['binary'] = (entry['iterations'] * entry['binary'] + iterations * binary_scores) / total
+            entry['iterations'] = total
+            if slices is not None:
+                entry['slices'] = slices
+
+        entry['size'] = _sizeof(key) + _sizeof(entry['slices']) + _sizeof(entry['binary']) + 256
+        if entry['size'] <= self.max_memory:
+            self.entries[key] = entry
+            self.memory += entry['size']
+
+        while self.memory > self.max_memory:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory -= evicted['size']
+
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.memory = 0
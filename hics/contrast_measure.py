@@ -2,21 +2,93 @@
 
 import numpy as np
 import pandas as pd
-from hics.divergences import KLD, KS
+from hics.divergences import KLD, KS, batched_divergence
+from scipy.stats import norm
 import math
 from random import randint, shuffle
 from collections import defaultdict
 
+_POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """Number of set bits along the last axis of a contiguous uint64 array
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def set_bit_positions(bitset):
+    """Positions of the set bits of a little-endian uint64 bitset, grouped by bit and not sorted. Only the non-zero
+    words are visited, one pass per bit, so no byte per row is allocated
+    """
+    words = np.flatnonzero(bitset)
+    values = bitset[words]
+    words = words * 64
+    positions = [words[(values >> np.uint64(bit)) & np.uint64(1) != 0] + bit for bit in range(64)]
+    return np.concatenate(positions)
+
+
+def _merge_moments(moments, scores):
+    """Adds scores to running (count, mean, sum of squared deviations), see Chan et al.
+    """
+    count, mean, squared_deviations = moments
+    scores = np.asarray(scores, dtype=float)
+    batch_mean = scores.mean()
+    delta = batch_mean - mean
+    total = count + len(scores)
+
+    mean += delta * len(scores) / total
+    squared_deviations += ((scores - batch_mean) ** 2).sum() + delta ** 2 * count * len(scores) / total
+    return total, mean, squared_deviations
+
 
 class HiCS:
-    def __init__(self, data, alpha, iterations, continuous_divergence=KS, categorical_divergence=KLD):
+    # Per-feature array caches that parallel workers receive through shared memory
+    shared_caches = ['columns', 'codes', 'sorted_indices', 'sorted_values', 'value_indices', 'class_bitsets',
+                     'marginal_counts', 'marginal_cdfs']
+
+    def __init__(self, data, alpha, iterations, continuous_divergence=KS, categorical_divergence=KLD,
+                 batched=False, max_batch_memory=256 * 2 ** 20, bitset_masks=False, contrast_cache=None,
+                 adaptive_tolerance=None, min_iterations=10, confidence=0.95):
+        """Keyword arguments:
+        iterations -- number of slices per contrast estimate, the upper bound if adaptive_tolerance is set
+        batched -- draw the slices of a chunk of iterations at once into an (iterations x rows) mask, see
+                   iterate_batched_slices. It is at best slightly faster, for subspaces of three or more features,
+                   while the default path over sorted positions is several times faster for 1-D subspaces
+        max_batch_memory -- bytes of the mask of one chunk in batched mode
+        adaptive_tolerance -- if set, an estimate stops early once the confidence interval of the mean slice score
+                              is narrower than +- adaptive_tolerance, checked every min_iterations slices
+        min_iterations -- lower bound of slices per adaptive estimate
+        confidence -- confidence level of the interval
+        """
         self.iterations = iterations
         self.alpha = alpha
         self.data = data
+        self.rows = len(data)
         self.categorical_divergence = categorical_divergence
         self.continuous_divergence = continuous_divergence
-        self.sorted_indices = pd.DataFrame()
+        self.sorted_indices = {}
+        self.sorted_values = {}
         self.distributions = {}
+        self.columns = {}
+        self.codes = {}
+        self.value_indices = {}
+        self.class_bitsets = {}
+        self.marginal_counts = {}
+        self.marginal_cdfs = {}
+        self.batched = batched
+        self.max_batch_memory = max_batch_memory
+        self.bitset_masks = bitset_masks
+        self.contrast_cache = contrast_cache
+        self.last_iterations = 0
+        self.last_cached_iterations = 0
+        # Reused by calculate_slice_positions, all False between calls
+        self.membership = None
+        self.adaptive_tolerance = adaptive_tolerance
+        self.min_iterations = min(min_iterations, iterations)
+        self.z_score = norm.ppf(0.5 + confidence / 2)
 
         self.types = {}
         self.values = {}
@@ -34,8 +106,73 @@ class HiCS:
             else:
                 self.types[column] = 'continuous'
 
-        self.index_lookup = pd.DataFrame(data=np.arange(len(self.data)),
-                                         index=self.data.index)  # Alternative to index.get_loc for custom indices
+    def precompute(self, features):
+        """Fills all caches needed to calculate contrasts over features, so that self.data is not needed anymore
+        """
+        for feature in features:
+            self.cached_column(feature)
+            self.cached_marginal_distribution(feature)
+            self.cached_marginal_cdf(feature)
+            if self.types[feature] == 'continuous':
+                self.cached_sorted_values(feature)
+            else:
+                self.cached_value_indices(feature)
+                if self.bitset_masks:
+                    self.cached_class_bitsets(feature)
+
+    def append_rows(self, rows):
+        """Appends rows (a DataFrame with the same columns) by merging them into the column arrays and all filled
+        caches instead of rebuilding them. Sorted indices and values are merged by insertion, codes, marginal counts
+        and inverted indices are remapped if new values appear. Feature types and the reported slice values of
+        categorical features stay as detected initially. The data frame and cached contrasts are dropped
+        """
+        # All caches derive from the columns, so the data is not needed (nor copied) anymore
+        for feature in self.types:
+            self.cached_column(feature)
+        self.data = None
+
+        old_rows = self.rows
+        self.rows = old_rows + len(rows)
+
+        for feature in list(self.columns):
+            new_column = rows[feature].values
+
+            if feature in self.sorted_indices:
+                # Stable merge, new rows go after old rows with equal values like a stable sort would put them
+                old_sorted = self.cached_sorted_values(feature)
+                new_order = np.argsort(new_column, kind='mergesort')
+                insert_at = np.searchsorted(old_sorted, new_column[new_order], side='right')
+                self.sorted_indices[feature] = np.insert(self.sorted_indices[feature], insert_at, new_order + old_rows)
+                self.sorted_values[feature] = np.insert(old_sorted, insert_at, new_column[new_order])
+
+            if feature in self.codes:
+                old_values, old_codes = self.codes[feature]
+                values = np.union1d(old_values, new_column)
+                remap = np.searchsorted(values, old_values)
+                new_codes = np.searchsorted(values, new_column)
+
+                old_counts = np.zeros(len(values), dtype=np.int64)
+                old_counts[remap] = self.cached_marginal_counts(feature)
+                self.codes[feature] = (values, np.concatenate([remap[old_codes], new_codes]))
+                new_counts = np.bincount(new_codes, minlength=len(values))
+                self.marginal_counts[feature] = old_counts + new_counts
+
+                if feature in self.value_indices:
+                    # Every new row goes to the end of the old block of its value
+                    old_positions, _ = self.value_indices[feature]
+                    old_offsets = np.r_[0, np.cumsum(old_counts)]
+                    new_order = np.argsort(new_codes, kind='mergesort')
+                    positions = np.insert(old_positions, old_offsets[new_codes[new_order] + 1], new_order + old_rows)
+                    self.value_indices[feature] = (positions, np.r_[0, np.cumsum(self.marginal_counts[feature])])
+
+            self.columns[feature] = np.concatenate([self.columns[feature], new_column])
+
+        # Cheap to rebuild lazily from the merged caches
+        self.distributions = {}
+        self.marginal_cdfs = {}
+        self.class_bitsets = {}
+        if self.contrast_cache is not None:
+            self.contrast_cache.clear()
 
     def get_values(self, feature):
         if feature not in self.values:
@@ -53,57 +190,265 @@ class HiCS:
 
     def cached_marginal_distribution(self, feature):
         if feature not in self.distributions:
-            values, counts = np.unique(self.data[feature], return_counts=True)
+            values, _ = self.cached_codes(feature)
+            counts = self.cached_marginal_counts(feature)
             self.distributions[feature] = pd.DataFrame({'value': values, 'count': counts,
-                                                        'probability': counts / len(self.data)}).sort_values(by='value')
+                                                        'probability': counts / self.rows})
         return self.distributions[feature]
 
+    def cached_marginal_counts(self, feature):
+        """Fixed-length count vector of feature, aligned with the values of cached_codes
+        """
+        if feature not in self.marginal_counts:
+            values, codes = self.cached_codes(feature)
+            self.marginal_counts[feature] = np.bincount(codes, minlength=len(values))
+        return self.marginal_counts[feature]
+
+    def cached_column(self, feature):
+        if feature not in self.columns:
+            self.columns[feature] = self.data[feature].values
+        return self.columns[feature]
+
+    def cached_codes(self, feature):
+        """Sorted unique values of feature and the dense integer code of every row into them
+        """
+        if feature not in self.codes:
+            self.codes[feature] = np.unique(self.cached_column(feature), return_inverse=True)
+        return self.codes[feature]
+
+    def cached_marginal_cdf(self, feature):
+        """Empirical CDF of feature evaluated at each of its sorted unique values
+        """
+        if feature not in self.marginal_cdfs:
+            self.marginal_cdfs[feature] = np.cumsum(self.cached_marginal_counts(feature)) / self.rows
+        return self.marginal_cdfs[feature]
+
+    def cached_value_indices(self, feature):
+        """Inverted index of a categorical feature in CSR layout: row positions grouped by value code, where the
+        rows of code c are positions[offsets[c]:offsets[c + 1]]
+        """
+        if feature not in self.value_indices:
+            _, codes = self.cached_codes(feature)
+            positions = np.argsort(codes, kind='mergesort')
+            offsets = np.r_[0, np.cumsum(self.cached_marginal_counts(feature))]
+            self.value_indices[feature] = (positions, offsets)
+        return self.value_indices[feature]
+
+    def cached_class_bitsets(self, feature):
+        """(values x words) matrix holding the packed bitset of the rows of every value of a categorical feature
+        """
+        if feature not in self.class_bitsets:
+            positions, offsets = self.cached_value_indices(feature)
+            self.class_bitsets[feature] = np.array([self.packed_bitset(positions[start:end])
+                                                    for start, end in zip(offsets[:-1], offsets[1:])])
+        return self.class_bitsets[feature]
+
     def cached_sorted_indices(self, feature):
-        if feature not in self.sorted_indices.columns:
-            self.sorted_indices[feature] = self.data.sort_values(by=feature, kind='mergesort').index.values
+        """Row positions (not index labels) of feature, sorted stably by value
+        """
+        if feature not in self.sorted_indices:
+            self.sorted_indices[feature] = np.argsort(self.cached_column(feature), kind='mergesort')
         return self.sorted_indices[feature]
 
-    def calculate_conditional_distribution(self, slice_conditions, target):
-        filter_array = np.array([True] * len(self.data))
+    def cached_sorted_values(self, feature):
+        """Values of feature in the order of cached_sorted_indices, as a contiguous array
+        """
+        if feature not in self.sorted_values:
+            self.sorted_values[feature] = np.ascontiguousarray(
+                self.cached_column(feature)[self.cached_sorted_indices(feature)])
+        return self.sorted_values[feature]
+
+    def calculate_slice_positions(self, slice_conditions):
+        """Intersects the row positions ('indices') of all slice conditions. Starting from the smallest condition,
+        candidates are filtered against a membership mask of each other condition, which is set and reset only at
+        that condition's positions. The mask is allocated once and kept, so the cost is linear in the condition
+        sizes rather than in the number of rows
+        """
+        slice_conditions = sorted(slice_conditions, key=lambda condition: len(condition['indices']))
+        positions = slice_conditions[0]['indices']
+
+        if len(slice_conditions) > 1:
+            if self.membership is None or len(self.membership) != self.rows:
+                self.membership = np.zeros(self.rows, dtype=bool)
+            membership = self.membership
+            for slice_condition in slice_conditions[1:]:
+                membership[slice_condition['indices']] = True
+                positions = positions[membership[positions]]
+                membership[slice_condition['indices']] = False
+
+        return positions
+
+    def packed_bitset(self, positions):
+        """Packs row positions into a little-endian bitset of uint64 words, setting the bits directly so that no
+        byte per row is allocated
+        """
+        positions = np.asarray(positions, dtype=np.uint64)
+        bitset = np.zeros((self.rows + 63) // 64, dtype=np.uint64)
+        np.bitwise_or.at(bitset, positions >> np.uint64(6), np.left_shift(np.uint64(1), positions & np.uint64(63)))
+        return bitset
+
+    def calculate_slice_bitset(self, slice_conditions):
+        """Intersects all slice conditions word-wise as packed bitsets, one bit instead of one byte per row
+        """
+        bitset = self.packed_bitset(slice_conditions[0]['indices'])
+        for slice_condition in slice_conditions[1:]:
+            np.bitwise_and(bitset, self.packed_bitset(slice_condition['indices']), out=bitset)
+        return bitset
+
+    def calculate_slice_sample(self, slice_conditions, target):
+        """Target codes (see cached_codes) of all rows inside the slice
+        """
+        _, codes = self.cached_codes(target)
+
+        if self.bitset_masks and len(slice_conditions) > 1:
+            bitset = self.calculate_slice_bitset(slice_conditions)
+
+            if self.types[target] == 'categorical':
+                counts = popcount(bitset & self.cached_class_bitsets(target))
+                # Scoring only needs the multiset of target codes, so the class counts stand in for the rows
+                return np.repeat(np.arange(len(counts)), counts)
 
-        for slice_condition in slice_conditions:
-            temp_filter = np.array([False] * len(self.data))
-            temp_filter[self.index_lookup.ix[slice_condition['indices']]] = True
-            filter_array = np.logical_and(temp_filter, filter_array)
+            # Like the class counts above, the rows are in no particular order
+            return codes[set_bit_positions(bitset)]
 
-        values, counts = np.unique(self.data.loc[filter_array, target], return_counts=True)
-        probabilities = counts / filter_array.sum()
-        return pd.DataFrame({'value': values, 'count': counts, 'probability': probabilities}).sort_values(by='value')
+        return codes[self.calculate_slice_positions(slice_conditions)]
+
+    def calculate_conditional_counts(self, slice_conditions, target):
+        """Histogram of target inside the slice as a count vector aligned with the values of cached_codes
+        """
+        values, _ = self.cached_codes(target)
+        return np.bincount(self.calculate_slice_sample(slice_conditions, target), minlength=len(values))
+
+    def distribution_from_counts(self, target, counts):
+        values, _ = self.cached_codes(target)
+        present = counts > 0
+        present_counts = counts[present]
+        return pd.DataFrame({'value': values[present], 'count': present_counts,
+                             'probability': present_counts / present_counts.sum()})
+
+    def calculate_conditional_distribution(self, slice_conditions, target):
+        return self.distribution_from_counts(target, self.calculate_conditional_counts(slice_conditions, target))
 
     def create_categorical_condition(self, feature, instances_per_dimension):
-        feature_distribution = self.cached_marginal_distribution(feature)
-        shuffled_values = np.random.permutation(feature_distribution['value'])
-        selected_values = []
-        current_sum = 0
+        values, _ = self.cached_codes(feature)
+        counts = self.cached_marginal_counts(feature)
+        positions, offsets = self.cached_value_indices(feature)
+        shuffled_codes = np.random.permutation(len(values))
 
         # select random values of feature until there are >= instances_per_dimension samples with one of these values
-        for value in shuffled_values:
-            if current_sum < instances_per_dimension:
-                selected_values.append(value)
-                current_sum = current_sum + \
-                    feature_distribution.loc[feature_distribution['value'] == value, 'count'].values
-            else:
-                break
+        shuffled_counts = counts[shuffled_codes]
+        covered_before = np.cumsum(shuffled_counts) - shuffled_counts
+        selected_codes = shuffled_codes[covered_before < instances_per_dimension]
 
-        indices = self.data.loc[self.data[feature].isin(selected_values), ].index.tolist()
-        return {'feature': feature, 'indices': indices, 'values': selected_values}
+        indices = np.concatenate([positions[offsets[code]:offsets[code + 1]] for code in selected_codes])
+        return {'feature': feature, 'indices': indices, 'values': values[selected_codes].tolist()}
 
     def create_continuous_condition(self, feature, instances_per_dimension):
         sorted_feature = self.cached_sorted_indices(feature)
+        sorted_values = self.cached_sorted_values(feature)
         max_start = len(sorted_feature) - instances_per_dimension
         start = randint(0, max_start)
         end = start + (instances_per_dimension - 1)
 
-        start_value = self.data.loc[sorted_feature[start], feature]
-        end_value = self.data.loc[sorted_feature[end], feature]
-        indices = self.data.loc[np.logical_and(self.data[feature] >= start_value, self.data[feature] <= end_value), :] \
-            .index.values.tolist()
-        return {'feature': feature, 'indices': indices, 'from_value': start_value, 'to_value': end_value}
+        start_value = sorted_values[start]
+        end_value = sorted_values[end]
+        # Widen the rank range to all ties of the boundary values, i.e. all rows with start_value <= x <= end_value
+        start = np.searchsorted(sorted_values, start_value, side='left')
+        end = np.searchsorted(sorted_values, end_value, side='right')
+        return {'feature': feature, 'indices': sorted_feature[start:end], 'from_value': start_value,
+                'to_value': end_value}
+
+    def create_slice_conditions(self, features, instances_per_dimension):
+        slice_conditions = []
+
+        for feature in features:
+            if self.types[feature] == 'categorical':
+                slice_conditions.append(self.create_categorical_condition(feature, instances_per_dimension))
+            else:
+                slice_conditions.append(self.create_continuous_condition(feature, instances_per_dimension))
+
+        return slice_conditions
+
+    def iterate_slices(self, features, target, instances_per_dimension):
+        """Yields slice conditions and the target codes of the rows inside the slice for every iteration
+        """
+        if self.batched:
+            yield from self.iterate_batched_slices(features, target, instances_per_dimension)
+            return
+
+        for iteration in range(self.iterations):
+            slice_conditions = self.create_slice_conditions(features, instances_per_dimension)
+            yield slice_conditions, self.calculate_slice_sample(slice_conditions, target)
+
+    def batch_size(self, instances_per_dimension):
+        """Number of iterations whose slice masks and samples fit into max_batch_memory
+        """
+        bytes_per_iteration = 2 * self.rows + 24 * instances_per_dimension
+        # Adaptive estimates check for convergence every min_iterations slices, larger chunks would be wasted
+        iterations = self.min_iterations if self.adaptive_tolerance is not None else self.iterations
+        return int(min(max(self.max_batch_memory // bytes_per_iteration, 1), iterations))
+
+    def create_batched_categorical_conditions(self, feature, instances_per_dimension, batch, mask):
+        """Draws batch categorical conditions at once and intersects them into the rows of mask
+        """
+        feature_distribution = self.cached_marginal_distribution(feature)
+        values = feature_distribution['value'].values
+        counts = feature_distribution['count'].values
+        _, codes = self.cached_codes(feature)
+
+        # Row-wise random permutations of the values, selected until >= instances_per_dimension samples are covered
+        order = np.argsort(np.random.rand(batch, len(values)), axis=1)
+        shuffled_counts = counts[order]
+        covered_before = np.cumsum(shuffled_counts, axis=1) - shuffled_counts
+        selected = np.zeros((batch, len(values)), dtype=bool)
+        np.put_along_axis(selected, order, covered_before < instances_per_dimension, axis=1)
+
+        np.logical_and(mask, selected[:, codes], out=mask)
+        return [{'feature': feature, 'values': values[row].tolist()} for row in selected]
+
+    def create_batched_continuous_conditions(self, feature, instances_per_dimension, batch, mask):
+        """Draws batch continuous conditions at once and intersects them into the rows of mask
+        """
+        sorted_values = self.cached_sorted_values(feature)
+        column = self.cached_column(feature)
+        max_start = len(sorted_values) - instances_per_dimension
+        starts = np.random.randint(0, max_start + 1, size=batch)
+
+        start_values = sorted_values[starts]
+        end_values = sorted_values[starts + (instances_per_dimension - 1)]
+        np.logical_and(mask, column >= start_values[:, None], out=mask)
+        np.logical_and(mask, column <= end_values[:, None], out=mask)
+        return [{'feature': feature, 'from_value': start_value, 'to_value': end_value}
+                for start_value, end_value in zip(start_values, end_values)]
+
+    def iterate_batched_slices(self, features, target, instances_per_dimension):
+        """Batched alternative to drawing slices one by one. The slice bounds of a whole chunk of iterations are
+        drawn at once into an (iterations x rows) mask matrix, bounded by max_batch_memory, and the target samples
+        of all slices are read out of it in one pass. Draws from np.random only, so results differ from the
+        sequential mode for the same seed
+        """
+        _, target_codes = self.cached_codes(target)
+        chunk_size = self.batch_size(instances_per_dimension)
+
+        for chunk_start in range(0, self.iterations, chunk_size):
+            batch = min(chunk_size, self.iterations - chunk_start)
+            mask = np.ones((batch, self.rows), dtype=bool)
+            conditions = []
+
+            for feature in features:
+                if self.types[feature] == 'categorical':
+                    conditions.append(self.create_batched_categorical_conditions(feature, instances_per_dimension,
+                                                                                 batch, mask))
+                else:
+                    conditions.append(self.create_batched_continuous_conditions(feature, instances_per_dimension,
+                                                                                batch, mask))
+
+            rows, positions = np.nonzero(mask)
+            del mask
+            samples = np.split(target_codes[positions], np.cumsum(np.bincount(rows, minlength=batch))[:-1])
+
+            for iteration in range(batch):
+                yield [condition[iteration] for condition in conditions], samples[iteration]
 
     def output_slices(self, score, conditions, slices):
         for condition in conditions:
@@ -129,52 +474,172 @@ class HiCS:
 
         return slices
 
+    def calculate_divergence(self, target, conditional_counts, sum_binary_scores, wrar=False):
+        """Scores a single slice through the configured divergence functions
+        """
+        marginal_distribution = self.cached_marginal_distribution(target)
+        conditional_distribution = self.distribution_from_counts(target, conditional_counts)
+
+        if self.types[target] == 'categorical':
+            class_scores, binary_scores = self.categorical_divergence(conditional_distribution,
+                                                                      marginal_distribution,
+                                                                      wrar=wrar)
+
+            score = 0
+            for value, d in class_scores.items():
+                score += d
+
+            for value, d in binary_scores.items():
+                sum_binary_scores[value]['sum'] += d
+                sum_binary_scores[value]['count'] += 1
+        else:
+            score = self.continuous_divergence(marginal_distribution, conditional_distribution)
+
+        return score
+
+    def calculate_batched_divergences(self, kernel, target, conditional_counts, sum_binary_scores, wrar=False):
+        """Scores all slices at once from their (iterations x classes) count matrix through an array-level kernel.
+        Classes not present in a slice are left out, like the realignment of the DataFrame divergences does
+        """
+        values, _ = self.cached_codes(target)
+        present = conditional_counts > 0
+        P = conditional_counts / conditional_counts.sum(axis=1, keepdims=True)
+        Q = self.cached_marginal_counts(target) / self.rows
+
+        class_scores, binary_scores = kernel(P, Q, wrar=wrar)
+
+        if binary_scores is not None:
+            binary_sums = np.where(present, binary_scores, 0).sum(axis=0)
+            binary_counts = present.sum(axis=0)
+            for value, binary_sum, binary_count in zip(values, binary_sums, binary_counts):
+                if binary_count:
+                    sum_binary_scores[value]['sum'] += binary_sum
+                    sum_binary_scores[value]['count'] += binary_count
+
+        return np.where(present, class_scores, 0).sum(axis=1)
+
+    def score_slices(self, target, samples, sum_binary_scores, wrar=False):
+        """Scores a list of non-empty slice samples (see iterate_slices). Targets with a batched divergence kernel
+        are histogrammed and scored in one vectorized pass, other divergences are called slice by slice
+        """
+        values, _ = self.cached_codes(target)
+        classes = len(values)
+
+        if self.types[target] == 'categorical':
+            kernel = batched_divergence(self.categorical_divergence)
+        else:
+            kernel = batched_divergence(self.continuous_divergence)
+
+        if kernel is None:
+            return [self.calculate_divergence(target, np.bincount(sample, minlength=classes), sum_binary_scores,
+                                              wrar=wrar)
+                    for sample in samples]
+
+        lengths = np.array([len(sample) for sample in samples])
+        slice_codes = np.concatenate(samples)
+
+        if self.types[target] == 'categorical':
+            slice_ids = np.repeat(np.arange(len(samples)), lengths)
+            conditional_counts = np.bincount(slice_ids * classes + slice_codes, minlength=len(samples) * classes) \
+                .reshape(len(samples), classes)
+            scores = self.calculate_batched_divergences(kernel, target, conditional_counts, sum_binary_scores,
+                                                        wrar=wrar)
+        else:
+            scores = kernel(self.cached_marginal_cdf(target), slice_codes, lengths)
+
+        return scores.tolist()
+
     def calculate_contrast(self, features, target, return_slices=False, cost_matrix=None, weight_mod=1):
-        slices = {'features': {}, 'scores': []}
+        self.last_cached_iterations = 0
+        if self.contrast_cache is None:
+            score, slices, binary_div_df = self.estimate_contrast(features, target, return_slices, cost_matrix)
 
-        instances_per_dimension = max(round(len(self.data) * math.pow(self.alpha, 1 / len(features))), 5)
+        else:
+            key = self.contrast_cache.key(self, features, target, cost_matrix)
+            entry = self.contrast_cache.get(key, return_slices)
 
-        marginal_distribution = self.cached_marginal_distribution(target)
+            if entry is None:
+                score, slices, binary_div_df = self.estimate_contrast(features, target, return_slices, cost_matrix)
+                self.contrast_cache.add(key, score, self.last_iterations, slices if return_slices else None,
+                                        binary_div_df)
 
-        sum_scores = 0
-        iterations = self.iterations
+            else:
+                # A reused estimate is no new evidence: last_iterations is 0, last_cached_iterations is what it
+                # would weigh as one fresh estimate (not all slices accumulated for it)
+                self.last_iterations = 0
+                self.last_cached_iterations = min(entry['iterations'], self.iterations)
+                score, slices, binary_div_df = entry['score'], entry['slices'], entry['binary']
 
-        sum_binary_scores = defaultdict(lambda: {'sum': 0, 'count': 0})
-        for iteration in range(iterations):
-            slice_conditions = []
+        # cost_matrix is not None if target is class, score is cost-weighted then
+        if cost_matrix is not None:
+            if return_slices:
+                return score, slices, binary_div_df
+            else:
+                return score, binary_div_df
 
-            for feature in features:
-                if self.types[feature] == 'categorical':
-                    slice_conditions.append(self.create_categorical_condition(feature, instances_per_dimension))
-                else:
-                    slice_conditions.append(self.create_continuous_condition(feature, instances_per_dimension))
+        if return_slices:
+            return score, slices
+        else:
+            return score
 
-            conditional_distribution = self.calculate_conditional_distribution(slice_conditions, target)
+    def converged(self, moments):
+        """Whether the running (count, mean, squared deviations) of the slice scores is precise enough to stop
+        """
+        count, _, squared_deviations = moments
+        if count < max(self.min_iterations, 2):
+            return False
 
-            if conditional_distribution.empty:
-                iterations = iterations - 1
-                continue
+        half_width = self.z_score * math.sqrt(squared_deviations / (count - 1) / count)
+        return half_width <= self.adaptive_tolerance
 
-            if self.types[target] == 'categorical':
-                class_scores, binary_scores = self.categorical_divergence(conditional_distribution,
-                                                                          marginal_distribution,
-                                                                          wrar=cost_matrix is not None)
+    def estimate_contrast(self, features, target, return_slices=False, cost_matrix=None):
+        """Monte Carlo estimate of the contrast, returns the score, slices and (if cost_matrix is given) the binary
+        divergences per class. The number of slices used is kept in self.last_iterations
+        """
+        slices = {'features': {}, 'scores': []}
 
-                score = 0
-                for value, d in class_scores.items():
-                    score += d
+        instances_per_dimension = max(round(self.rows * math.pow(self.alpha, 1 / len(features))), 5)
 
-                for value, d in binary_scores.items():
-                    sum_binary_scores[value]['sum'] += d
-                    sum_binary_scores[value]['count'] += 1
-            else:
-                score = self.continuous_divergence(marginal_distribution, conditional_distribution)
+        scores = []
+        samples = []
+        sample_size = 0
+        used_conditions = []
+        adaptive = self.adaptive_tolerance is not None
+        moments = (0, 0.0, 0.0)
 
-            sum_scores = sum_scores + score
+        sum_binary_scores = defaultdict(lambda: {'sum': 0, 'count': 0})
+        for slice_conditions, sample in self.iterate_slices(features, target, instances_per_dimension):
+            if not len(sample):
+                continue
 
+            samples.append(sample)
+            sample_size += len(sample)
             if return_slices:
+                used_conditions.append(slice_conditions)
+
+            # Score in chunks so that pending samples stay below the memory cap
+            if 8 * sample_size > self.max_batch_memory or (adaptive and len(samples) >= self.min_iterations):
+                new_scores = self.score_slices(target, samples, sum_binary_scores, wrar=cost_matrix is not None)
+                scores += new_scores
+                samples = []
+                sample_size = 0
+
+                if adaptive:
+                    moments = _merge_moments(moments, new_scores)
+                    if self.converged(moments):
+                        break
+
+        if samples:
+            scores += self.score_slices(target, samples, sum_binary_scores, wrar=cost_matrix is not None)
+
+        if return_slices:
+            for score, slice_conditions in zip(scores, used_conditions):
                 slices = self.output_slices(score, slice_conditions, slices)
 
+        sum_scores = sum(scores)
+        iterations = len(scores)
+        self.last_iterations = iterations
+
         # Primary measure (correlation)
         avg_score = sum_scores / iterations
 
@@ -184,12 +649,6 @@ class HiCS:
             for k, v in sum_binary_scores.items():
                 binary_div_df.loc[0, k] = v['sum'] / v['count']
             div_score = (cost_matrix * binary_div_df).iloc[0].sum() / cost_matrix.iloc[0].sum()
-            if return_slices:
-                return div_score, slices, binary_div_df
-            else:
-                return div_score, binary_div_df
+            return div_score, slices, binary_div_df
 
-        if return_slices:
-            return avg_score, slices
-        else:
-            return avg_score
+        return avg_score, slices, None
@@ -4,49 +4,119 @@ import numpy as np
 import pandas as pd
 
 
+def kld_matrix(P, Q, wrar=False):
+    """Kullback-Leibler divergence on (batch x classes) probability matrices
+    P -- Conditional probabilities, one row per slice
+    Q -- Marginal probabilities, one row per slice or a single row shared by all slices
+    Returns the per-slice, per-class divergences and, if wrar, the per-class binary divergences (else None)
+    """
+    P = np.atleast_2d(P)
+    Q = np.atleast_2d(Q)
+    divergences = P * np.log2(np.maximum(P, 1e-8) / Q)  # Clipping to guarantee valid logarithm
+
+    binary_divergences = None
+    if wrar:
+        binary_divergences = divergences + (1 - P) * np.log2(np.maximum(1 - P, 1e-8) / np.maximum(1 - Q, 1e-8))
+
+    return divergences, binary_divergences
+
+
+def jsd_matrix(P, Q, wrar=False):
+    """Jensen-Shannon divergence on (batch x classes) probability matrices, see kld_matrix
+    """
+    P = np.atleast_2d(P)
+    Q = np.atleast_2d(Q)
+    M = (P + Q) * 0.5
+    p_divergences, p_binary = kld_matrix(P, M, wrar=wrar)
+    q_divergences, q_binary = kld_matrix(Q, M, wrar=wrar)
+
+    binary_divergences = None
+    if wrar:
+        binary_divergences = (p_binary + q_binary) * 0.5
+
+    return (p_divergences + q_divergences) * 0.5, binary_divergences
+
+
+def _align(P: pd.DataFrame, Q: pd.DataFrame):
+    P = P.loc[P['value'].isin(Q['value']), ].reset_index(drop=True)
+    Q = Q.loc[Q['value'].isin(P['value']), ].reset_index(drop=True)
+    return P, Q
+
+
+def _to_dicts(values, divergences, binary_divergences):
+    divergences = dict(zip(values, divergences[0]))
+    if binary_divergences is None:
+        return divergences, {}
+    return divergences, dict(zip(values, binary_divergences[0]))
+
+
 def KLD(P: pd.DataFrame, Q: pd.DataFrame, homogenous=False, wrar=False):
     """Kullback-Leibler divergence
     P -- Conditional distribution
     Q -- Marginal distribution
     """
     if not homogenous:
-        P = P.loc[P['value'].isin(Q['value']), ].reset_index(drop=True)
-        Q = Q.loc[Q['value'].isin(P['value']), ].reset_index(drop=True)
-
-    divergences = {}
-    binary_divergences = {}
-    for value, p_prob, q_prob in zip(P['value'], P['probability'], Q['probability']):
-        p_clipped = max(p_prob, 1e-8)  # To guarantee valid logarithm
-        divergences[value] = p_prob * np.log2(p_clipped / q_prob)
-        if wrar:
-            binary_divergences[value] = p_prob * np.log2(p_clipped / q_prob) + \
-                (1 - p_prob) * np.log2(max(1 - p_prob, 1e-8) / max(1 - q_prob, 1e-8))
+        P, Q = _align(P, Q)
 
-    return divergences, binary_divergences
+    divergences, binary_divergences = kld_matrix(P['probability'].values, Q['probability'].values, wrar=wrar)
+    return _to_dicts(P['value'], divergences, binary_divergences)
 
 
-def JSD(P: pd.DataFrame, Q: pd.DataFrame):
+def JSD(P: pd.DataFrame, Q: pd.DataFrame, wrar=False):
     """Jensen-Shannon divergence
     """
-    P = P.loc[P['value'].isin(Q['value']), ].reset_index(drop=True)
-    Q = Q.loc[Q['value'].isin(P['value']), ].reset_index(drop=True)
-    M = pd.DataFrame({'probability': (P.probability + Q.probability) * 0.5})
-    return (KLD(P, M, homogenous=True) + KLD(Q, M, homogenous=True)) * 0.5
+    P, Q = _align(P, Q)
+    divergences, binary_divergences = jsd_matrix(P['probability'].values, Q['probability'].values, wrar=wrar)
+    return _to_dicts(P['value'], divergences, binary_divergences)
+
+
+def ks_matrix(marginal_cdf, slice_codes, slice_lengths):
+    """Exact Kolmogorov-Smirnov distance of many slices against the marginal distribution at once
+    marginal_cdf -- Marginal CDF evaluated at each sorted unique value
+    slice_codes -- Codes (indices into the sorted unique values) of all slices' samples, concatenated
+    slice_lengths -- Number of samples per slice, all > 0
+    """
+    classes = len(marginal_cdf)
+    slice_ids = np.repeat(np.arange(len(slice_lengths)), slice_lengths)
+    keys = np.sort(slice_ids * classes + slice_codes)
+    slice_starts = np.cumsum(slice_lengths) - slice_lengths
+
+    # Runs of equal keys are ties of one value inside one slice
+    run_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    run_ends = np.r_[run_starts[1:], len(keys)]
+    run_slices = keys[run_starts] // classes
+    run_codes = keys[run_starts] % classes
+
+    # Both CDFs are step functions, so the supremum is attained at a sample value or right before it
+    lengths = slice_lengths[run_slices]
+    conditional_right = (run_ends - slice_starts[run_slices]) / lengths
+    conditional_left = (run_starts - slice_starts[run_slices]) / lengths
+    marginal_right = marginal_cdf[run_codes]
+    marginal_left = np.where(run_codes > 0, marginal_cdf[run_codes - 1], 0)
+
+    distances = np.maximum(np.abs(marginal_right - conditional_right), np.abs(marginal_left - conditional_left))
+    return np.maximum.reduceat(distances, np.searchsorted(run_slices, np.arange(len(slice_lengths))))
 
 
 def KS(P: pd.DataFrame, Q: pd.DataFrame, should_normalize=False, max_divergence=1, min_divergence=0):
-    """Kolmogorov–Smirnov test
+    """Kolmogorov–Smirnov test, exact supremum distance between the empirical CDFs of P and Q
     """
-    current_divergence = 0
+    cutpoints = np.union1d(P['value'], Q['value'])
 
-    cutpoints = np.random.rand(50) * (Q.iloc[-1]['value'] - Q.iloc[0]['value']) + Q.iloc[-1]['value']
+    def cdf(distribution):
+        cumulative = np.r_[0, np.cumsum(distribution['count'].values)]
+        return cumulative[np.searchsorted(distribution['value'].values, cutpoints, side='right')] / cumulative[-1]
 
-    samples = Q['count'].sum()
-    N = P['count'].sum()
-    for cut in cutpoints:
-        sample_probability = (Q['value'] <= cut).sum() / samples
-        real_probability = (P['value'] <= cut).sum() / N
-        current_divergence = max(current_divergence, abs(sample_probability - real_probability))
+    current_divergence = np.abs(cdf(P) - cdf(Q)).max()
     if should_normalize:
         current_divergence = (current_divergence - min_divergence) / (max_divergence - min_divergence)
     return current_divergence
+
+
+BATCHED_DIVERGENCES = {KLD: kld_matrix, JSD: jsd_matrix, KS: ks_matrix}
+
+
+def batched_divergence(divergence):
+    """Array-level kernel of divergence, or None if divergence has no batched version
+    """
+    return BATCHED_DIVERGENCES.get(divergence)
@@ -1,5 +1,6 @@
 # Created by Marcus Pappik
 
+import itertools
 import numpy as np
 import pandas as pd
 import sys
@@ -7,12 +8,29 @@ from random import randint
 from hics.contrast_measure import HiCS
 from hics.scored_slices import ScoredSlices
 from hics.result_storage import DefaultResultStorage
+from hics.parallel import ContrastPool, run_seeded
 
 
 class IncrementalCorrelation:
     def __init__(self, data, target, result_storage, iterations=10,
-                 alpha=0.1, drop_discrete=False, cost_matrix=None, weight_mod=1):
-        self.subspace_contrast = HiCS(data, alpha, iterations)
+                 alpha=0.1, drop_discrete=False, cost_matrix=None, weight_mod=1, n_jobs=1, seed=None,
+                 contrast_cache=None, adaptive_tolerance=None, min_iterations=10):
+        """Keyword arguments:
+        iterations -- slices per contrast estimate, the upper bound if adaptive_tolerance is set
+        adaptive_tolerance -- stop estimates early once the mean slice score is known to +- this tolerance, see HiCS.
+                              Results are weighted by the slices actually used
+        min_iterations -- lower bound of slices per adaptive estimate
+        n_jobs -- number of worker processes for the Monte Carlo runs. The process pool is kept between runs, close
+                  it with close() or by using the correlation as a context manager
+        seed -- if set (or if n_jobs > 1), every run draws from its own random stream derived from this seed,
+                so results are reproducible and independent of n_jobs
+        contrast_cache -- optional hics.contrast_cache.ContrastCache reused for repeated subspaces
+        """
+        self.subspace_contrast = HiCS(data, alpha, iterations, contrast_cache=contrast_cache,
+                                      adaptive_tolerance=adaptive_tolerance, min_iterations=min_iterations)
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.seed_sequence = np.random.SeedSequence(seed)
 
         self.target = target
         self.features = [str(ft) for ft in data.columns.values
@@ -23,44 +41,76 @@ class IncrementalCorrelation:
         if drop_discrete:
             self.features = [ft for ft in self.features
                              if self.subspace_contrast.get_type(ft) != 'discrete']
+        # Integer ids of the features, rows and columns of the bivariate redundancy arrays
+        self.feature_ids = pd.Index(self.features)
 
         self.result_storage = result_storage
+        self.pool = None
+
+    def configure(self, n_jobs=1, seed=None, iterations=10, adaptive_tolerance=None, min_iterations=10):
+        """Applies the run options of __init__ to later runs. The random streams only restart for a different seed,
+        further runs with the same seed continue them instead of drawing the same subsets again
+        """
+        contrast = self.subspace_contrast
+        if (iterations, adaptive_tolerance) != (contrast.iterations, contrast.adaptive_tolerance):
+            # The workers hold copies of the contrast
+            self.close()
+        contrast.iterations = iterations
+        contrast.adaptive_tolerance = adaptive_tolerance
+        contrast.min_iterations = min(min_iterations, iterations)
+
+        self.n_jobs = n_jobs
+        if seed != self.seed:
+            self.seed = seed
+            self.seed_sequence = np.random.SeedSequence(seed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shuts down the worker pool of runs with n_jobs > 1, the next run starts a new one
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def append_rows(self, rows):
+        """Appends rows to the dataset. The HiCS caches are merged instead of rebuilt, stored results are kept but
+        their iteration weights are scaled by the share of old rows, so that the next updates quickly move them
+        towards estimates on the full data
+        """
+        # The workers hold the old caches
+        self.close()
+        old_rows = self.subspace_contrast.rows
+        self.subspace_contrast.append_rows(rows)
+        self.result_storage.discount(old_rows / self.subspace_contrast.rows)
 
     def _update_relevancy_table(self, new_relevancies):
         """Updates relevancies by averaging it with existing values
         """
-        current_relevancies = self.result_storage.get_relevancies()
-
-        new_index = [index for index in new_relevancies.index
-                     if index not in current_relevancies.index]
-
-        relevancy_apppend = pd.DataFrame(data=0, index=new_index,
-                                         columns=current_relevancies.columns)
-        current_relevancies = current_relevancies.append(relevancy_apppend)
-
-        current_relevancies.loc[new_relevancies.index, 'relevancy'] = \
-            (current_relevancies.iteration / (current_relevancies.iteration + new_relevancies.iteration)) \
-            * current_relevancies.relevancy \
-            + \
-            (new_relevancies.iteration / (current_relevancies.iteration + new_relevancies.iteration)) \
-            * new_relevancies.relevancy
-        current_relevancies.loc[new_relevancies.index, 'iteration'] += new_relevancies.iteration
-
-        self.result_storage.update_relevancies(current_relevancies)
+        self.result_storage.accumulate_relevancies(new_relevancies)
 
     def _update_redundancy_table(self, new_redundancies):
-        # Calculate bivariate redundancies for fast access
-        bivariate_redundancies = pd.DataFrame(data=np.inf, columns=self.features, index=self.features)
-        bivariate_weights = pd.DataFrame(data=0, columns=self.features, index=self.features)
-        for row in new_redundancies.itertuples():
-            subspace, target = row.Index
-            for ft in subspace:
-                redundancy = min(bivariate_redundancies.loc[ft, target], row.redundancy)
-                bivariate_redundancies.loc[ft, target] = redundancy
-                bivariate_redundancies.loc[target, ft] = redundancy
-                bivariate_weights.loc[ft, target] = bivariate_weights.loc[ft, target] + row.iteration
-                bivariate_weights.loc[target, ft] = bivariate_weights.loc[target, ft] + row.iteration
-
+        # Calculate bivariate redundancies for fast access: every (feature in subspace, target) pair of a redundancy
+        # takes its minimal redundancy and the sum of its iterations, in both directions
+        subspaces = [index[0] for index in new_redundancies.index]
+        lengths = np.fromiter(map(len, subspaces), dtype=np.int64, count=len(subspaces))
+        subspace_ids = self.feature_ids.get_indexer(list(itertools.chain.from_iterable(subspaces)))
+        target_ids = np.repeat(self.feature_ids.get_indexer([index[1] for index in new_redundancies.index]), lengths)
+        pairs = (np.concatenate([subspace_ids, target_ids]), np.concatenate([target_ids, subspace_ids]))
+        pair_redundancies = np.tile(np.repeat(new_redundancies.redundancy.values.astype(float), lengths), 2)
+        pair_weights = np.tile(np.repeat(new_redundancies.iteration.values.astype(float), lengths), 2)
+
+        redundancies = np.full((len(self.features), len(self.features)), np.inf)
+        np.minimum.at(redundancies, pairs, pair_redundancies)
+        weights = np.zeros((len(self.features), len(self.features)))
+        np.add.at(weights, pairs, pair_weights)
+
+        bivariate_redundancies = pd.DataFrame(redundancies, columns=self.features, index=self.features)
+        bivariate_weights = pd.DataFrame(weights, columns=self.features, index=self.features)
         self.result_storage.update_bivariate_redundancies(bivariate_redundancies, bivariate_weights)
         # Save subset redundancies for further calculations
         self.result_storage.update_redundancies(new_redundancies)
@@ -77,14 +127,32 @@ class IncrementalCorrelation:
 
             current_slices[feature_set].reduce_slices()
 
-        self.result_storage.update_slices(current_slices)
+        self.result_storage.update_slices(current_slices, changed=new_slices.keys())
 
-    def _relevancy_dict_to_df(self, new_scores):
+    def _relevancy_dict_to_df(self, new_scores, column='relevancy'):
         indices = [tuple(index) for index in new_scores]
         scores = [score for index, score in new_scores.items()]
-        new_relevancies = pd.DataFrame(data=scores, index=indices)
+        new_relevancies = pd.DataFrame(data=scores, index=indices, columns=[column, 'iteration'])
         return new_relevancies
 
+    def _add_score(self, new_scores, key, column, score, weights, stored):
+        """Adds the score of a run with weights (see _run_weights) to new_scores and returns whether it counted.
+        Cached contrasts are no new evidence, they only count for subsets without any new or stored estimate
+        """
+        weight, cached_weight = weights
+        if not weight:
+            if key in new_scores or key in stored:
+                return False
+            weight = cached_weight
+        if not weight:
+            return False
+
+        if key not in new_scores:
+            new_scores[key] = {column: 0, 'iteration': 0}
+        new_scores[key][column] += weight * score
+        new_scores[key]['iteration'] += weight
+        return True
+
     def _add_slices_to_dict(self, subspace, slices, slices_store):
         subspace_tuple = tuple(sorted(subspace))
         if subspace_tuple not in slices_store:
@@ -100,24 +168,80 @@ class IncrementalCorrelation:
         slices_store[subspace_tuple].add_slices(slices)
         return slices_store
 
+    def map_runs(self, function, arguments):
+        """Calls function(self, *args) for every argument tuple and yields the results in order. Runs on the global
+        random state unless a seed or several jobs are configured, see __init__. With n_jobs > 1, the runs are
+        distributed over a ContrastPool that is kept for further calls until close()
+        """
+        if self.n_jobs == 1 and self.seed is None:
+            for args in arguments:
+                yield function(self, *args)
+            return
+
+        seed_sequences = self.seed_sequence.spawn(len(arguments))
+        if self.n_jobs == 1:
+            for seed_sequence, args in zip(seed_sequences, arguments):
+                yield run_seeded(function, seed_sequence, self, args)
+            return
+
+        if self.pool is not None and self.pool.n_jobs != self.n_jobs:
+            self.close()
+        if self.pool is None:
+            self.pool = ContrastPool(self, self.n_jobs).start()
+        yield from self.pool.map(function, seed_sequences, arguments)
+
+    def _run_weights(self):
+        """Weight of the last estimate in full runs, less than 1 if it stopped early or skipped empty slices, and
+        the weight it would have if it was taken from the contrast cache (otherwise 0), see _add_score
+        """
+        return (self.subspace_contrast.last_iterations / self.subspace_contrast.iterations,
+                self.subspace_contrast.last_cached_iterations / self.subspace_contrast.iterations)
+
+    def _bivariate_run(self, feature):
+        subspace_score, subspace_slices = self.subspace_contrast.calculate_contrast(
+            [feature], self.target, True, cost_matrix=self.cost_matrix, weight_mod=self.weight_mod)
+        return feature, subspace_score, subspace_slices, self._run_weights()
+
+    def _multivariate_run(self, fixed_features, feature_list, max_k, cost_matrix):
+        subspace = fixed_features[:]
+
+        if 0 < max_k:
+            end_index = randint(1, max_k)
+            subspace += np.random.permutation(feature_list)[0:end_index].tolist()
+
+        if cost_matrix is None:
+            subspace_score, subspace_slices = self.subspace_contrast.calculate_contrast(
+                subspace, self.target, True, cost_matrix=self.cost_matrix, weight_mod=1)
+        else:
+            # subspace_score is DataFrame with value per class!
+            _, subspace_slices, subspace_score = self.subspace_contrast.calculate_contrast(
+                subspace, self.target, True, cost_matrix=self.cost_matrix, weight_mod=1)
+
+        return subspace, subspace_score, subspace_slices, self._run_weights()
+
+    def _redundancy_run(self, k):
+        number_features = randint(1, k)
+        selected_features = np.random.permutation(self.features)[0:number_features + 1].tolist()
+        target = selected_features[number_features]
+        subspace = selected_features[0:number_features]
+
+        score = self.subspace_contrast.calculate_contrast(subspace, target, False)
+        return subspace, target, score, self._run_weights()
+
     def update_bivariate_relevancies(self, runs=5):
         """Reruns relevancy calculation of individual features toward the target. Result will be averaged with
         previous values to update the relevancy score
         """
         new_slices = {}
-        new_scores = {(feature,): {'relevancy': 0, 'iteration': 0} for feature in self.features}
-
-        for i in range(runs):
-            for feature in self.features:
-                subspace_tuple = (feature,)
-                subspace_score, subspace_slices = self.subspace_contrast.calculate_contrast(
-                    [feature], self.target, True, cost_matrix=self.cost_matrix, weight_mod=self.weight_mod)
+        new_scores = {}
+        stored = self.result_storage.get_relevancies().index
 
+        arguments = [(feature,) for i in range(runs) for feature in self.features]
+        for feature, subspace_score, subspace_slices, weights in self.map_runs(IncrementalCorrelation._bivariate_run,
+                                                                                arguments):
+            if self._add_score(new_scores, (feature,), 'relevancy', subspace_score, weights, stored):
                 new_slices = self._add_slices_to_dict([feature], subspace_slices, new_slices)
 
-                new_scores[subspace_tuple]['relevancy'] += subspace_score
-                new_scores[subspace_tuple]['iteration'] += 1
-
         new_relevancies = self._relevancy_dict_to_df(new_scores)
         new_relevancies.relevancy /= new_relevancies.iteration
 
@@ -135,40 +259,21 @@ class IncrementalCorrelation:
         """
         new_slices = {}
         new_scores = {}
-        class_scores = {}
+        stored = self.result_storage.get_relevancies().index
 
         feature_list = [feature for feature in self.features if feature not in fixed_features]
         max_k = k - len(fixed_features)
         max_k = min(max_k, len(feature_list))
 
-        for i in range(runs):
+        arguments = [(fixed_features, feature_list, max_k, cost_matrix)] * runs
+        results = self.map_runs(IncrementalCorrelation._multivariate_run, arguments)
+        for i, (subspace, subspace_score, subspace_slices, weights) in enumerate(results):
             # Progress counter
             sys.stdout.write('\rRelevance: {:.2f}%     '.format(100 * i / runs))
             sys.stdout.flush()
 
-            subspace = fixed_features[:]
-
-            if 0 < max_k:
-                end_index = randint(1, max_k)
-                subspace += np.random.permutation(feature_list)[0:end_index].tolist()
-
-            subspace_tuple = tuple(sorted(subspace))
-
-            if cost_matrix is None:
-                subspace_score, subspace_slices = self.subspace_contrast.calculate_contrast(
-                    subspace, self.target, True, cost_matrix=self.cost_matrix, weight_mod=1)
-            else:
-                # subspace_score is DataFrame with value per class!
-                _, subspace_slices, subspace_score = self.subspace_contrast.calculate_contrast(
-                    subspace, self.target, True, cost_matrix=self.cost_matrix, weight_mod=1)
-
-            if subspace_tuple not in new_scores:
-                new_scores[subspace_tuple] = {'relevancy': 0, 'iteration': 0}
-
-            new_scores[subspace_tuple]['relevancy'] += subspace_score
-            new_scores[subspace_tuple]['iteration'] += 1
-
-            new_slices = self._add_slices_to_dict(subspace, subspace_slices, new_slices)
+            if self._add_score(new_scores, tuple(sorted(subspace)), 'relevancy', subspace_score, weights, stored):
+                new_slices = self._add_slices_to_dict(subspace, subspace_slices, new_slices)
         # print('\rRelevance: 100.00%')
 
         new_relevancies = self._relevancy_dict_to_df(new_scores)
@@ -187,24 +292,13 @@ class IncrementalCorrelation:
         # new_weights = pd.DataFrame(data=0, columns=self.features, index=self.features)
 
         new_scores = {}
+        stored = self.result_storage.get_redundancies().index
 
         k = min(k, len(self.features) - 1)
-        for i in range(runs):
-            number_features = randint(1, k)
-            selected_features = np.random.permutation(self.features)[0:number_features + 1].tolist()
-            target = selected_features[number_features]
-            subspace = selected_features[0:number_features]
-
-            subspace_feature_tuple = (tuple(sorted(subspace)), target)
-            score = self.subspace_contrast.calculate_contrast(subspace, target, False)
-
-            if subspace_feature_tuple not in new_scores:
-                new_scores[subspace_feature_tuple] = {'redundancy': 0, 'iteration': 0}
-
-            new_scores[subspace_feature_tuple]['redundancy'] += score
-            new_scores[subspace_feature_tuple]['iteration'] += 1
+        for subspace, target, score, weights in self.map_runs(IncrementalCorrelation._redundancy_run, [(k,)] * runs):
+            self._add_score(new_scores, (tuple(sorted(subspace)), target), 'redundancy', score, weights, stored)
 
-        new_redundancies = self._relevancy_dict_to_df(new_scores)
+        new_redundancies = self._relevancy_dict_to_df(new_scores, 'redundancy')
         new_redundancies.redundancy /= new_redundancies.iteration
 
         self._update_redundancy_table(new_redundancies)
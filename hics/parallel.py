@@ -0,0 +1,198 @@
+import copy
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+class SharedArray:
+    """Picklable handle of a NumPy array in a SharedBlock. Only the offset, shape and dtype are pickled, workers
+    view the same memory instead of receiving a copy
+    """
+
+    def __init__(self, array):
+        # Kept until the SharedBlock copied it
+        self.array = array
+        self.offset = 0
+        self.shape = array.shape
+        self.dtype = array.dtype
+
+    def __getstate__(self):
+        return {'offset': self.offset, 'shape': self.shape, 'dtype': self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.array = None
+
+    def view(self, buffer):
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=buffer, offset=self.offset)
+
+
+class SharedBlock:
+    """One shared memory segment holding the arrays of all SharedArray handles at aligned offsets, so that a pool
+    opens a single segment (and its file descriptors) however many columns are cached
+    """
+
+    ALIGNMENT = 64
+
+    def __init__(self, shared_arrays):
+        size = 0
+        for shared_array in shared_arrays:
+            shared_array.offset = size
+            size += -(-shared_array.array.nbytes // SharedBlock.ALIGNMENT) * SharedBlock.ALIGNMENT
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.name = self.memory.name
+        try:
+            for shared_array in shared_arrays:
+                shared_array.view(self.memory.buf)[...] = shared_array.array
+                shared_array.array = None
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        try:
+            self.memory.close()
+        except BufferError:
+            # A view is still referenced somewhere, the mapping is freed together with it
+            pass
+        self.memory.unlink()
+
+
+def _share(value, shared_arrays):
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        shared_array = SharedArray(value)
+        shared_arrays.append(shared_array)
+        return shared_array
+
+    if isinstance(value, tuple):
+        return tuple(_share(element, shared_arrays) for element in value)
+
+    return value
+
+
+def _view(value, buffer):
+    if isinstance(value, SharedArray):
+        return value.view(buffer)
+
+    if isinstance(value, tuple):
+        return tuple(_view(element, buffer) for element in value)
+
+    return value
+
+
+def _copy(value):
+    if isinstance(value, np.ndarray):
+        return value.copy()
+
+    if isinstance(value, tuple):
+        return tuple(_copy(element) for element in value)
+
+    return value
+
+
+def seed_random_state(seed_sequence):
+    """Seeds both random sources HiCS draws from with a stream derived from seed_sequence
+    """
+    state = seed_sequence.generate_state(4)
+    random.seed(int.from_bytes(state.tobytes(), 'little'))
+    np.random.seed(state)
+
+
+def run_seeded(function, seed_sequence, correlation, arguments):
+    seed_random_state(seed_sequence)
+    return function(correlation, *arguments)
+
+
+_worker = {'correlation': None, 'memory': None}
+
+
+def _init_worker(correlation, block_name):
+    # Pool workers share the resource tracker of the parent, which unlinks the block in release()
+    _worker['memory'] = shared_memory.SharedMemory(name=block_name)
+    contrast = correlation.subspace_contrast
+    for cache in contrast.shared_caches:
+        setattr(contrast, cache, {feature: _view(value, _worker['memory'].buf)
+                                  for feature, value in getattr(contrast, cache).items()})
+    _worker['correlation'] = correlation
+
+
+def _run_task(task):
+    function, seed_sequence, arguments = task
+    return run_seeded(function, seed_sequence, _worker['correlation'], arguments)
+
+
+class ContrastPool:
+    """Process pool calculating contrasts for an IncrementalCorrelation. The HiCS precomputations (column values,
+    codes, sorted indices and marginals) of all columns are moved into one shared memory block once: the contrast of
+    the correlation continues on views of this block, and the workers attach to the same block, so that neither the
+    dataset nor the caches are pickled or held twice. Object columns cannot be shared and are pickled instead.
+    The pool and the per-worker contrast caches are kept until close(), which moves the caches back into private
+    memory
+    """
+
+    def __init__(self, correlation, n_jobs):
+        self.correlation = correlation
+        self.n_jobs = n_jobs
+        self.block = None
+        self.executor = None
+
+    def start(self):
+        contrast = self.correlation.subspace_contrast
+        contrast.precompute(list(contrast.types))
+
+        worker_contrast = copy.copy(contrast)
+        worker_contrast.data = None
+        worker_contrast.membership = None
+        if contrast.contrast_cache is not None:
+            worker_contrast.contrast_cache = contrast.contrast_cache.empty_copy()
+        shared_arrays = []
+        shared_caches = {cache: {feature: _share(value, shared_arrays)
+                                 for feature, value in getattr(contrast, cache).items()}
+                         for cache in contrast.shared_caches}
+
+        try:
+            self.block = SharedBlock(shared_arrays)
+            for cache, shared_cache in shared_caches.items():
+                setattr(worker_contrast, cache, shared_cache)
+                setattr(contrast, cache, {feature: _view(value, self.block.memory.buf)
+                                          for feature, value in shared_cache.items()})
+
+            worker_correlation = copy.copy(self.correlation)
+            worker_correlation.subspace_contrast = worker_contrast
+            worker_correlation.result_storage = None
+            worker_correlation.pool = None
+
+            self.executor = ProcessPoolExecutor(max_workers=self.n_jobs, initializer=_init_worker,
+                                                initargs=(worker_correlation, self.block.name))
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.block is not None:
+            contrast = self.correlation.subspace_contrast
+            for cache in contrast.shared_caches:
+                setattr(contrast, cache, {feature: _copy(value)
+                                          for feature, value in getattr(contrast, cache).items()})
+            self.block.release()
+            self.block = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def map(self, function, seed_sequences, arguments):
+        """Calls function(correlation, *args) in the workers for every seed and argument tuple, yielding the results
+        in order. function must be picklable, e.g. defined at module or class level
+        """
+        tasks = [(function, seed_sequence, args) for seed_sequence, args in zip(seed_sequences, arguments)]
+        chunksize = max(1, len(tasks) // (4 * self.n_jobs))
+        return self.executor.map(_run_task, tasks, chunksize=chunksize)
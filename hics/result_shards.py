@@ -0,0 +1,131 @@
+import json
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+from hics.result_storage import DefaultResultStorage, RunningMeans, _plain, _slices_dict, _slices_json, _tuples
+from hics.scored_slices import ScoredSlices
+
+SHARD_SUFFIX = '.shard'
+SHARD_VERSION = 2
+
+
+def write_shard(result_storage, path):
+    """Writes the results of a storage to a shard file, a compressed numpy .npz archive without pickled objects: the
+    relevancy and redundancy means with their iterations and the bivariate redundancies and weights as arrays,
+    the subsets, features and slices as JSON. Class score DataFrames of cost-sensitive runs become a
+    (subsets x rows x classes) array. The file is written next to path and then renamed, so a merge never reads a
+    partial shard
+    """
+    relevancies = result_storage.get_relevancies()
+    redundancies = result_storage.get_redundancies()
+    bivariate_redundancies, bivariate_weights = result_storage.get_bivariate_redundancies()
+
+    relevancy_scores = relevancies.relevancy.values
+    class_frame = None
+    if relevancy_scores.dtype == object:
+        class_frame = relevancy_scores[0]
+        relevancy_scores = np.array([np.asarray(scores.values, dtype=float) for scores in relevancy_scores])
+
+    meta = {
+        'version': SHARD_VERSION,
+        'features': list(bivariate_redundancies.index),
+        'relevancies': list(relevancies.index),
+        'classes': None if class_frame is None else (list(class_frame.index), list(class_frame.columns)),
+        'redundancies': list(redundancies.index),
+        'slices': [(subset, _slices_json(slices)) for subset, slices in result_storage.get_slices().items()]
+    }
+
+    partial_path = '{}.{}.partial'.format(path, os.getpid())
+    with open(partial_path, 'wb') as file:
+        np.savez_compressed(file, meta=np.array(json.dumps(meta, default=_plain)),
+                            relevancies=np.asarray(relevancy_scores, dtype=float),
+                            relevancy_iterations=np.asarray(relevancies.iteration, dtype=float),
+                            redundancies=np.asarray(redundancies.redundancy, dtype=float),
+                            redundancy_iterations=np.asarray(redundancies.iteration, dtype=float),
+                            bivariate_redundancies=bivariate_redundancies.values.astype(float),
+                            bivariate_weights=bivariate_weights.values.astype(float))
+    os.replace(partial_path, path)
+
+
+def read_shard(path):
+    """Loads a shard written by write_shard. Shards only hold arrays and JSON, reading them never unpickles, so
+    shards of a shared directory can not run code
+    """
+    try:
+        with np.load(path, allow_pickle=False) as archive:
+            meta = json.loads(str(archive['meta']))
+            arrays = {name: archive[name] for name in archive.files}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        raise ValueError('{} is not a result shard'.format(path))
+
+    if meta.get('version') != SHARD_VERSION:
+        raise ValueError('{} is not a result shard of version {}'.format(path, SHARD_VERSION))
+
+    relevancy_scores = arrays['relevancies']
+    if meta['classes'] is not None:
+        rows, classes = (_tuples(labels) for labels in meta['classes'])
+        scores = np.empty(len(relevancy_scores), dtype=object)
+        for i, class_scores in enumerate(relevancy_scores):
+            scores[i] = pd.DataFrame(class_scores, index=list(rows), columns=list(classes))
+        relevancy_scores = scores
+
+    return {
+        'features': [_tuples(feature) for feature in meta['features']],
+        'relevancies': ([_tuples(subset) for subset in meta['relevancies']], relevancy_scores,
+                        arrays['relevancy_iterations']),
+        'redundancies': ([_tuples(index) for index in meta['redundancies']], arrays['redundancies'],
+                         arrays['redundancy_iterations']),
+        'bivariate': (arrays['bivariate_redundancies'], arrays['bivariate_weights']),
+        'slices': {_tuples(subset): _slices_dict(slices) for subset, slices in meta['slices']}
+    }
+
+
+def shard_paths(directory):
+    """Shard files in directory, sorted by name so that merges are reproducible
+    """
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SHARD_SUFFIX))
+
+
+def merge_shards(paths, result_storage=None):
+    """Combines the shards at paths (or all shards of a directory) into result_storage, a new DefaultResultStorage
+    by default. Relevancies and redundancies are averaged weighted by their iterations, as by
+    IncrementalCorrelation updates, bivariate redundancies keep their minimum and slices are added and reduced.
+    Shards must have been written for the same features
+    """
+    if isinstance(paths, str):
+        paths = shard_paths(paths)
+
+    features = None
+    for path in paths:
+        shard = read_shard(path)
+        if features is None:
+            features = shard['features']
+            if result_storage is None:
+                result_storage = DefaultResultStorage(features)
+        elif shard['features'] != features:
+            raise ValueError('{} was written for the features {}, not {}'.format(path, shard['features'], features))
+
+        result_storage.accumulate_relevancies(RunningMeans('relevancy', *shard['relevancies']).frame())
+        result_storage.update_redundancies(RunningMeans('redundancy', *shard['redundancies']).frame())
+
+        redundancies, weights = shard['bivariate']
+        result_storage.update_bivariate_redundancies(pd.DataFrame(redundancies, index=features, columns=features),
+                                                     pd.DataFrame(weights, index=features, columns=features))
+
+        current_slices = result_storage.get_slices()
+        for subset, slices_dict in shard['slices'].items():
+            slices = ScoredSlices.from_dict(slices_dict)
+            if subset not in current_slices:
+                current_slices[subset] = slices
+
+            else:
+                current_slices[subset].add_slices(slices)
+
+            current_slices[subset].reduce_slices()
+        result_storage.update_slices(current_slices, changed=shard['slices'].keys())
+
+    if features is None:
+        raise ValueError('No result shards to merge')
+    return result_storage
+
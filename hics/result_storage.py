@@ -1,5 +1,7 @@
 # Created by Marcus Pappik
 
+import json
+import sqlite3
 import numpy as np
 import pandas as pd
 from hics.scored_slices import ScoredSlices
@@ -10,13 +12,28 @@ class AbstractResultStorage:
     def update_relevancies(self, new_relevancies: pd.DataFrame):
         raise NotImplementedError()
 
+    def accumulate_relevancies(self, new_relevancies: pd.DataFrame):
+        """Averages new_relevancies into the stored relevancies, weighted by their iterations
+        """
+        current_relevancies = self.get_relevancies()
+        means = RunningMeans('relevancy', current_relevancies.index, current_relevancies.relevancy,
+                             current_relevancies.iteration)
+        means.add(new_relevancies.index, new_relevancies.relevancy, new_relevancies.iteration)
+        self.update_relevancies(means.frame())
+
     def update_redundancies(self, new_redundancies: pd.DataFrame):
         raise NotImplementedError()
 
     def update_bivariate_redundancies(self, new_redundancies: pd.DataFrame, new_weights: pd.DataFrame):
         raise NotImplementedError()
 
-    def update_slices(self, new_slices: dict()):
+    def update_slices(self, new_slices: dict(), changed=None):
+        """Stores new_slices, changed are the subsets whose slices were added or reduced since the last update
+        (default: all of them)
+        """
+        raise NotImplementedError()
+
+    def discount(self, factor: float):
         raise NotImplementedError()
 
     def get_bivariate_redundancies(self):
@@ -32,64 +49,141 @@ class AbstractResultStorage:
         raise NotImplementedError()
 
 
-class DefaultResultStorage(AbstractResultStorage):
+def _score_array(scores):
+    """Float array of scores, or an object array if they are class score DataFrames of cost-sensitive runs
+    """
+    array = np.empty(len(scores), dtype=object)
+    for i, score in enumerate(scores):
+        array[i] = score
 
-    def __init__(self, features: list()):
-        self.relevancies = pd.DataFrame(columns=['relevancy', 'iteration'])
-        self.redundancies = pd.DataFrame(columns=['redundancy', 'iteration'])
+    if all(isinstance(score, (int, float, np.number)) for score in array):
+        return array.astype(float)
+    return array
 
-        redundancy_dict = {
-            'redundancy': pd.DataFrame(data=0, columns=features, index=features),
-            'weight': pd.DataFrame(data=0, columns=features, index=features)
-        }
-        self.bivariate_redundancies = pd.Panel(redundancy_dict)
 
-        self.slices = {}
+class RunningMeans:
+    """Iteration-weighted means of the scores of subsets. A dict maps every subset to its row in arrays of means and
+    iterations, which grow geometrically, so adding estimates costs O(new entries) however many are stored. The
+    DataFrame of frame() is built on demand and kept until the next change
+    """
 
-    def update_relevancies(self, new_relevancies: pd.DataFrame):
-        self.relevancies = new_relevancies
+    def __init__(self, column, index=(), scores=(), iterations=()):
+        self.column = column
+        self.keys = list(index)
+        self.positions = {key: row for row, key in enumerate(self.keys)}
+        self.means = _score_array(scores)
+        self.iterations = np.array(iterations, dtype=float)
+        self.cached_frame = None
 
-    def update_redundancies(self, new_redundancies: pd.DataFrame):
-        """Updates redundancies by averaging it with existing values
+    def rows(self, index):
+        """Rows of the subsets in index, subsets not stored yet get a new row with mean and iterations 0
         """
-        current_redundancies = self.redundancies
+        rows = np.empty(len(index), dtype=np.int64)
+        for i, key in enumerate(index):
+            row = self.positions.get(key)
+            if row is None:
+                row = self.positions[key] = len(self.keys)
+                self.keys.append(key)
+            rows[i] = row
+
+        if len(self.keys) > len(self.iterations):
+            capacity = max(2 * len(self.iterations), len(self.keys), 16)
+            means = np.zeros(capacity, dtype=self.means.dtype)
+            means[:len(self.means)] = self.means
+            iterations = np.zeros(capacity)
+            iterations[:len(self.iterations)] = self.iterations
+            self.means, self.iterations = means, iterations
+        return rows
+
+    def add(self, index, scores, iterations):
+        """Averages scores, each the mean of iterations estimates, into the means of the (distinct) subsets in index
+        """
+        scores = _score_array(scores)
+        iterations = np.asarray(iterations, dtype=float)
+        rows = self.rows(index)
+        if scores.dtype == object:
+            self.means = self.means.astype(object)
+
+        total = self.iterations[rows] + iterations
+        self.means[rows] = (self.iterations[rows] / total) * self.means[rows] + (iterations / total) * scores
+        self.iterations[rows] = total
+        self.cached_frame = None
+
+    def discount(self, factor):
+        self.iterations *= factor
+        self.cached_frame = None
+
+    def frame(self):
+        if self.cached_frame is None:
+            size = len(self.keys)
+            self.cached_frame = pd.DataFrame({self.column: self.means[:size].copy(),
+                                              'iteration': self.iterations[:size].copy()},
+                                             index=pd.Index(self.keys, dtype=object, tupleize_cols=False),
+                                             columns=[self.column, 'iteration'])
+        return self.cached_frame
 
-        new_index = [index for index in new_redundancies.index
-                     if index not in current_redundancies.index]
 
-        redundancy_apppend = pd.DataFrame(data=0, index=new_index,
-                                          columns=current_redundancies.columns)
-        current_redundancies = current_redundancies.append(redundancy_apppend)
+class DefaultResultStorage(AbstractResultStorage):
+    """Keeps the results in memory, relevancies and redundancies as RunningMeans and the bivariate redundancies and
+    their weights as dense feature x feature arrays. The getters return DataFrames of them
+    """
 
-        current_redundancies.loc[new_redundancies.index, 'redundancy'] = \
-            (current_redundancies.iteration / (current_redundancies.iteration + new_redundancies.iteration)) \
-            * current_redundancies.redundancy \
-            + \
-            (new_redundancies.iteration / (current_redundancies.iteration + new_redundancies.iteration)) \
-            * new_redundancies.redundancy
-        current_redundancies.loc[new_redundancies.index, 'iteration'] += new_redundancies.iteration
+    def __init__(self, features: list()):
+        self.features = list(features)
+        self.relevancy_means = RunningMeans('relevancy')
+        self.redundancy_means = RunningMeans('redundancy')
 
-        self.redundancies = current_redundancies
+        self.bivariate_redundancy = np.zeros((len(features), len(features)))
+        self.bivariate_weight = np.zeros((len(features), len(features)))
 
-    def update_bivariate_redundancies(self, new_redundancies: pd.DataFrame, new_weights: pd.DataFrame):
-        current_weights = new_weights.loc[new_weights.index, new_weights.columns]
-        current_redundancies = new_redundancies.loc[new_redundancies.index, new_redundancies.columns]
+        self.slices = {}
 
-        current_redundancies[current_weights < 1] = np.inf
+    @property
+    def relevancies(self):
+        return self.relevancy_means.frame()
 
-        current_redundancies = np.minimum(new_redundancies, current_redundancies)
-        current_weights += new_weights
+    @property
+    def redundancies(self):
+        return self.redundancy_means.frame()
 
-        current_redundancies[current_weights < 1] = 0
+    def update_relevancies(self, new_relevancies: pd.DataFrame):
+        self.relevancy_means = RunningMeans('relevancy', new_relevancies.index, new_relevancies.relevancy,
+                                            new_relevancies.iteration)
 
-        self.bivariate_redundancies.redundancy = current_redundancies
-        self.bivariate_redundancies.weight = current_weights
+    def accumulate_relevancies(self, new_relevancies: pd.DataFrame):
+        self.relevancy_means.add(new_relevancies.index, new_relevancies.relevancy, new_relevancies.iteration)
 
-    def update_slices(self, new_slices):
+    def update_redundancies(self, new_redundancies: pd.DataFrame):
+        """Updates redundancies by averaging it with existing values
+        """
+        self.redundancy_means.add(new_redundancies.index, new_redundancies.redundancy, new_redundancies.iteration)
+
+    def update_bivariate_redundancies(self, new_redundancies: pd.DataFrame, new_weights: pd.DataFrame):
+        """Keeps the minimal redundancy of every feature pair over all updates and adds up their weights. Pairs
+        without weight have the redundancy 0
+        """
+        new_redundancies = new_redundancies.loc[self.features, self.features].values.astype(float)
+        new_weights = new_weights.loc[self.features, self.features].values.astype(float)
+
+        observed = self.bivariate_weight > 0
+        self.bivariate_redundancy = np.where(observed, np.minimum(self.bivariate_redundancy, new_redundancies),
+                                             new_redundancies)
+        self.bivariate_weight = self.bivariate_weight + new_weights
+        self.bivariate_redundancy[self.bivariate_weight <= 0] = 0
+
+    def update_slices(self, new_slices, changed=None):
         self.slices = new_slices
 
+    def discount(self, factor: float):
+        """Scales the iteration weights of all stored results, so that new estimates outweigh them
+        """
+        self.relevancy_means.discount(factor)
+        self.redundancy_means.discount(factor)
+        self.bivariate_weight = self.bivariate_weight * factor
+
     def get_bivariate_redundancies(self):
-        return self.bivariate_redundancies.redundancy, self.bivariate_redundancies.weight
+        return pd.DataFrame(self.bivariate_redundancy, index=self.features, columns=self.features), \
+            pd.DataFrame(self.bivariate_weight, index=self.features, columns=self.features)
 
     def get_redundancies(self):
         return self.redundancies
@@ -99,3 +193,193 @@ class DefaultResultStorage(AbstractResultStorage):
 
     def get_slices(self):
         return self.slices
+
+
+def _tuples(value):
+    # JSON turns the tuples of subsets and (subset, target) indices into lists
+    return tuple(_tuples(element) for element in value) if isinstance(value, list) else value
+
+
+def _plain(value):
+    # numpy scalars of feature names, class labels or slice bounds
+    return value.item()
+
+
+def _slices_json(slices):
+    """ScoredSlices.to_dict with the dicts keyed by feature names or category values as pairs, as JSON objects
+    only have string keys
+    """
+    dictionary = slices.to_dict()
+    return {'continuous': list(dictionary['continuous'].items()),
+            'categorical': [(name, list(description.items()))
+                            for name, description in dictionary['categorical'].items()],
+            'scores': dictionary['scores'], 'to_keep': dictionary['to_keep'], 'threshold': dictionary['threshold']}
+
+
+def _slices_dict(slices_json):
+    return {'continuous': {_tuples(name): description for name, description in slices_json['continuous']},
+            'categorical': {_tuples(name): {_tuples(value): mask for value, mask in description}
+                            for name, description in slices_json['categorical']},
+            'scores': slices_json['scores'], 'to_keep': slices_json['to_keep'], 'threshold': slices_json['threshold']}
+
+
+def _key(index):
+    """JSON text of a relevancy subset or redundancy (subset, target) index, tuples become lists
+    """
+    return json.dumps(index, default=_plain)
+
+
+def _index(key):
+    return _tuples(json.loads(key))
+
+
+def _value(value):
+    """Scores are stored as REAL, class score DataFrames of cost-sensitive runs as JSON text of their labels and
+    values
+    """
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return json.dumps({'index': list(value.index), 'columns': list(value.columns),
+                       'values': np.asarray(value.values, dtype=float).tolist()}, default=_plain)
+
+
+def _load_value(value):
+    if isinstance(value, bytes):
+        raise ValueError('Result storage holds pickled scores of an older version, which are not loaded')
+    if isinstance(value, str):
+        frame = json.loads(value)
+        return pd.DataFrame(frame['values'], index=[_tuples(label) for label in frame['index']],
+                            columns=[_tuples(label) for label in frame['columns']])
+    return value
+
+
+def _slices_text(slices):
+    return json.dumps(_slices_json(slices), default=_plain)
+
+
+def _load_slices(text):
+    if isinstance(text, bytes):
+        raise ValueError('Result storage holds pickled slices of an older version, which are not loaded')
+    return ScoredSlices.from_dict(_slices_dict(json.loads(text)))
+
+
+class SQLiteResultStorage(DefaultResultStorage):
+    """DefaultResultStorage persisted to an SQLite file. Results are also kept in memory, every update only writes
+    the relevancies, redundancies, bivariate cells and slices it changed, and the transaction is committed every
+    checkpoint_every updates. Opening an existing file restores its results, so a correlation using this storage
+    continues the iteration-weighted averages of the previous run
+    """
+
+    def __init__(self, path, features: list(), checkpoint_every=1):
+        super().__init__(features)
+        self.path = path
+        self.feature_names = [str(feature) for feature in features]
+        self.checkpoint_every = checkpoint_every
+        self.updates = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS relevancies (subset TEXT PRIMARY KEY, relevancy, iteration REAL);
+            CREATE TABLE IF NOT EXISTS redundancies (subset TEXT PRIMARY KEY, redundancy, iteration REAL);
+            CREATE TABLE IF NOT EXISTS bivariate (feature TEXT, other TEXT, redundancy REAL, weight REAL,
+                                                  PRIMARY KEY (feature, other));
+            CREATE TABLE IF NOT EXISTS slices (subset TEXT PRIMARY KEY, slices TEXT);
+        """)
+
+        # Persisted bivariate state, to find the cells an update changed
+        self.stored_bivariate = (np.zeros((len(features), len(features))),
+                                 np.zeros((len(features), len(features))))
+        self.load()
+
+    def load(self):
+        stored_features = self.connection.execute("SELECT value FROM meta WHERE key = 'features'").fetchone()
+        if stored_features is None:
+            self.connection.execute("INSERT INTO meta VALUES ('features', ?)", (json.dumps(self.feature_names),))
+            self.connection.commit()
+        elif json.loads(stored_features[0]) != self.feature_names:
+            raise ValueError('Result storage was created for the features {}'.format(stored_features[0]))
+
+        rows = self.connection.execute('SELECT subset, relevancy, iteration FROM relevancies').fetchall()
+        self.relevancy_means = RunningMeans('relevancy', [_index(row[0]) for row in rows],
+                                            [_load_value(row[1]) for row in rows], [row[2] for row in rows])
+
+        rows = self.connection.execute('SELECT subset, redundancy, iteration FROM redundancies').fetchall()
+        self.redundancy_means = RunningMeans('redundancy', [_index(row[0]) for row in rows],
+                                             [row[1] for row in rows], [row[2] for row in rows])
+
+        positions = {feature: i for i, feature in enumerate(self.feature_names)}
+        for feature, other, redundancy, weight in self.connection.execute(
+                'SELECT feature, other, redundancy, weight FROM bivariate'):
+            self.bivariate_redundancy[positions[feature], positions[other]] = redundancy
+            self.bivariate_weight[positions[feature], positions[other]] = weight
+        self.stored_bivariate = (self.bivariate_redundancy.copy(), self.bivariate_weight.copy())
+
+        for subset, slices in self.connection.execute('SELECT subset, slices FROM slices'):
+            self.slices[_index(subset)] = _load_slices(slices)
+
+    def checkpoint(self):
+        self.updates += 1
+        if self.updates % self.checkpoint_every == 0:
+            self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def write_means(self, table, means, index):
+        """Upserts the current means of the subsets in index
+        """
+        rows = means.rows(index)
+        self.connection.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?, ?)'.format(table),
+                                    [(_key(key), _value(means.means[row]), float(means.iterations[row]))
+                                     for key, row in zip(index, rows)])
+
+    def update_relevancies(self, new_relevancies: pd.DataFrame):
+        super().update_relevancies(new_relevancies)
+
+        self.connection.execute('DELETE FROM relevancies')
+        self.write_means('relevancies', self.relevancy_means, new_relevancies.index)
+        self.checkpoint()
+
+    def accumulate_relevancies(self, new_relevancies: pd.DataFrame):
+        super().accumulate_relevancies(new_relevancies)
+
+        self.write_means('relevancies', self.relevancy_means, new_relevancies.index)
+        self.checkpoint()
+
+    def update_redundancies(self, new_redundancies: pd.DataFrame):
+        super().update_redundancies(new_redundancies)
+
+        self.write_means('redundancies', self.redundancy_means, new_redundancies.index)
+        self.checkpoint()
+
+    def update_bivariate_redundancies(self, new_redundancies: pd.DataFrame, new_weights: pd.DataFrame):
+        super().update_bivariate_redundancies(new_redundancies, new_weights)
+
+        redundancies, weights = self.bivariate_redundancy, self.bivariate_weight
+        rows, columns = np.nonzero((redundancies != self.stored_bivariate[0]) | (weights != self.stored_bivariate[1]))
+
+        self.connection.executemany('INSERT OR REPLACE INTO bivariate VALUES (?, ?, ?, ?)',
+                                    [(self.feature_names[row], self.feature_names[column], redundancies[row, column],
+                                      weights[row, column]) for row, column in zip(rows, columns)])
+        self.stored_bivariate = (redundancies.copy(), weights.copy())
+        self.checkpoint()
+
+    def update_slices(self, new_slices, changed=None):
+        super().update_slices(new_slices, changed)
+
+        if changed is None:
+            self.connection.execute('DELETE FROM slices')
+            changed = new_slices.keys()
+        self.connection.executemany('INSERT OR REPLACE INTO slices VALUES (?, ?)',
+                                    [(_key(subset), _slices_text(new_slices[subset])) for subset in changed])
+        self.checkpoint()
+
+    def discount(self, factor: float):
+        super().discount(factor)
+
+        self.connection.execute('UPDATE relevancies SET iteration = iteration * ?', (factor,))
+        self.connection.execute('UPDATE redundancies SET iteration = iteration * ?', (factor,))
+        self.connection.execute('UPDATE bivariate SET weight = weight * ?', (factor,))
+        self.stored_bivariate = (self.stored_bivariate[0], self.stored_bivariate[1] * factor)
+        self.checkpoint()
@@ -2,28 +2,88 @@
 
 import numpy as np
 import pandas as pd
-from hics.slice_similarity import continuous_similarity_matrix, categorical_similarity_matrix
-from hics.slice_selection import select_by_similarity
+from hics.slice_similarity import continuous_similarities, categorical_similarities
 
 
 class ScoredSlices:
-    def __init__(self, categorical, continuous, to_keep=5, threshold=None):
-        self.continuous = {
-            feature: pd.DataFrame(columns=['to_value', 'from_value']) for feature in continuous
-        }
-
-        self.categorical = {
-            feature['name']: pd.DataFrame(columns=feature['values']) for feature in categorical
-        }
-
-        self.scores = pd.Series()
+    """Slices of a subspace with their scores, kept in NumPy arrays: one score, one from and to bound per continuous
+    feature and one boolean row of selected values per categorical feature. Arrays grow geometrically and hold at
+    most max_candidates slices, beyond that only the highest scored ones are kept. The DataFrame views continuous,
+    categorical and scores list the slices by descending score
+    """
+
+    def __init__(self, categorical, continuous, to_keep=5, threshold=None, max_candidates=2048):
+        self.continuous_features = list(continuous)
+        self.categorical_values = {feature['name']: list(feature['values']) for feature in categorical}
         self.to_keep = to_keep
+        self.max_candidates = max(max_candidates, to_keep)
 
         if threshold is None:
             self.threshold = ScoredSlices.default_threshold(len(categorical) + len(continuous))
         else:
             self.threshold = threshold
 
+        self.size = 0
+        self.is_sorted = True
+        self.allocate(0)
+
+    def allocate(self, capacity):
+        """Replaces the arrays by empty ones for capacity slices
+        """
+        self.score_array = np.empty(capacity)
+        self.from_values = np.empty((capacity, len(self.continuous_features)))
+        self.to_values = np.empty((capacity, len(self.continuous_features)))
+        self.masks = {feature: np.zeros((capacity, len(values)), dtype=bool)
+                      for feature, values in self.categorical_values.items()}
+
+    def append(self, scores, from_values, to_values, masks):
+        """Appends slices given as arrays in the layout of the attributes of the same names
+        """
+        count = len(scores)
+        if not count:
+            return
+
+        if self.size + count > len(self.score_array):
+            capacity = max(2 * len(self.score_array), self.size + count, 16)
+            self.take(np.arange(self.size), capacity)
+
+        rows = slice(self.size, self.size + count)
+        self.score_array[rows] = scores
+        self.from_values[rows] = from_values
+        self.to_values[rows] = to_values
+        for feature, mask in masks.items():
+            self.masks[feature][rows] = mask
+        self.size += count
+        self.is_sorted = False
+
+        if self.size > self.max_candidates:
+            # Top max_candidates by score in linear time, their order is restored by sort()
+            top = np.argpartition(-self.score_array[:self.size], self.max_candidates - 1)[:self.max_candidates]
+            self.take(top, len(self.score_array))
+
+    def take(self, rows, capacity=None):
+        """Keeps only the slices at rows, in this order
+        """
+        score_array, from_values, to_values, masks = \
+            self.score_array[rows], self.from_values[rows], self.to_values[rows], \
+            {feature: mask[rows] for feature, mask in self.masks.items()}
+
+        self.allocate(len(rows) if capacity is None else capacity)
+        self.size = len(rows)
+        self.score_array[:self.size] = score_array
+        self.from_values[:self.size] = from_values
+        self.to_values[:self.size] = to_values
+        for feature, mask in masks.items():
+            self.masks[feature][:self.size] = mask
+
+    def sort(self):
+        """Orders the slices by descending score, ties keep their insertion order
+        """
+        if not self.is_sorted:
+            order = np.argsort(-self.score_array[:self.size], kind='mergesort')
+            self.take(order, len(self.score_array))
+            self.is_sorted = True
+
     def add_slices(self, slices):
         if isinstance(slices, dict):
             self.add_from_dict(slices)
@@ -32,33 +92,44 @@ class ScoredSlices:
             self.add_from_object(slices)
 
     def add_from_object(self, slices):
-        self.scores = self.scores.append(pd.Series(slices.scores)).sort_values(ascending=False, inplace=False)
-
-        for feature, df in slices.continuous.items():
-            self.continuous[feature] = pd.concat([self.continuous[feature], df], ignore_index=True)
-            self.continuous[feature] = self.continuous[feature].loc[self.scores.index, :].reset_index(drop=True)
-
-        for feature, df in slices.categorical.items():
-            self.categorical[feature] = pd.concat([self.categorical[feature], df], ignore_index=True)
-            self.categorical[feature] = self.categorical[feature].loc[self.scores.index, :].reset_index(drop=True)
-
-        self.scores.reset_index(drop=True, inplace=True)
+        rows = slice(0, slices.size)
+        columns = [slices.continuous_features.index(feature) for feature in self.continuous_features]
+        self.append(slices.score_array[rows], slices.from_values[rows][:, columns],
+                    slices.to_values[rows][:, columns],
+                    {feature: mask[rows] for feature, mask in slices.masks.items()})
 
     def add_from_dict(self, slices):
-        new_scores = pd.Series(slices['scores'])
-        self.scores = self.scores.append(new_scores, ignore_index=True).sort_values(ascending=False, inplace=False)
-
-        for feature in self.continuous:
-            content = pd.DataFrame(slices['features'][feature])
-            self.continuous[feature] = pd.concat([self.continuous[feature], content], ignore_index=True)
-            self.continuous[feature] = self.continuous[feature].loc[self.scores.index, :].reset_index(drop=True)
-
-        for feature in self.categorical:
-            content = pd.DataFrame(slices['features'][feature], columns=self.categorical[feature].columns)
-            self.categorical[feature] = pd.concat([self.categorical[feature], content], ignore_index=True)
-            self.categorical[feature] = self.categorical[feature].loc[self.scores.index, :].reset_index(drop=True)
-
-        self.scores.reset_index(drop=True, inplace=True)
+        """Adds slices in the format of HiCS.output_slices
+        """
+        scores = np.asarray(slices['scores'], dtype=float)
+        if not len(scores):
+            return
+
+        features = slices['features']
+        from_values = np.array([features[feature]['from_value'] for feature in self.continuous_features],
+                               dtype=float).reshape(len(self.continuous_features), len(scores)).T
+        to_values = np.array([features[feature]['to_value'] for feature in self.continuous_features],
+                             dtype=float).reshape(len(self.continuous_features), len(scores)).T
+        masks = {feature: np.asarray(features[feature], dtype=bool) for feature in self.categorical_values}
+        self.append(scores, from_values, to_values, masks)
+
+    @property
+    def scores(self):
+        self.sort()
+        return pd.Series(self.score_array[:self.size])
+
+    @property
+    def continuous(self):
+        self.sort()
+        return {feature: pd.DataFrame({'to_value': self.to_values[:self.size, i],
+                                       'from_value': self.from_values[:self.size, i]})
+                for i, feature in enumerate(self.continuous_features)}
+
+    @property
+    def categorical(self):
+        self.sort()
+        return {feature: pd.DataFrame(self.masks[feature][:self.size].astype(int), columns=values)
+                for feature, values in self.categorical_values.items()}
 
     def select_slices(self, similarity):
         indices = list(range(len(similarity)))
@@ -76,31 +147,33 @@ class ScoredSlices:
         return selected
 
     def reduce_slices(self):
-        if self.continuous:
-            continuous_similarity = continuous_similarity_matrix(self.continuous)
-        else:
-            continuous_similarity = np.ones((len(self.scores), len(self.scores)))
-
-        if self.categorical:
-            categorical_similarity = categorical_similarity_matrix(self.categorical)
-        else:
-            categorical_similarity = np.ones((len(self.scores), len(self.scores)))
-
-        similarity = continuous_similarity * categorical_similarity
+        """Greedy selection of select_slices on the similarity matrices of hics.slice_similarity, but similarities
+        are only computed between each selected slice and the remaining candidates
+        """
+        self.sort()
+        from_values, to_values = self.from_values[:self.size], self.to_values[:self.size]
+        masks = [mask[:self.size] for mask in self.masks.values()]
+
+        remaining = np.ones(self.size, dtype=bool)
+        selected = []
+        for i in range(self.to_keep):
+            candidates = np.flatnonzero(remaining)
+            if not len(candidates):
+                break
 
-        selected = self.select_slices(similarity)
+            selection = candidates[0]
+            selected.append(selection)
 
-        if self.categorical:
-            self.categorical = {
-                key: df.loc[selected, :].reset_index(drop=True) for key, df in self.categorical.items()
-            }
+            similarity = np.ones(len(candidates))
+            if self.continuous_features:
+                similarity = continuous_similarities(from_values, to_values, selection, candidates)
+            if masks:
+                similarity = similarity * categorical_similarities(masks, selection, candidates)
 
-        if self.continuous:
-            self.continuous = {
-                key: df.loc[selected, :].reset_index(drop=True) for key, df in self.continuous.items()
-            }
+            # The selection itself stays a candidate if it is not similar to itself, as in select_slices
+            remaining[candidates] = similarity < self.threshold
 
-        self.scores = self.scores.loc[selected].reset_index(drop=True)
+        self.take(np.array(selected, dtype=int))
 
     def to_dict(self):
         continuous_dict = {name: df.to_dict(orient='list') for name, df in self.continuous.items()}
@@ -118,18 +191,19 @@ class ScoredSlices:
         if name_mapping is None:
             name_mapping = ScoredSlices.default_name_mapping
 
+        self.sort()
         result = []
-        for index, value in self.scores.iteritems():
-            current_result = {'deviation': value, 'features': {}}
+        for index in range(self.size):
+            current_result = {'deviation': float(self.score_array[index]), 'features': {}}
 
-            if self.continuous:
-                for feature, df in self.continuous.items():
-                    current_result['features'][name_mapping(feature)] = df.loc[index, :].to_dict()
+            for i, feature in enumerate(self.continuous_features):
+                current_result['features'][name_mapping(feature)] = {'to_value': float(self.to_values[index, i]),
+                                                                     'from_value': float(self.from_values[index, i])}
 
-            if self.categorical:
-                for feature, df in self.categorical.items():
-                    selected_values = df.columns[df.loc[index, :] == 1].astype(float).tolist()  # TODO: remove this
-                    current_result['features'][name_mapping(feature)] = selected_values
+            for feature, values in self.categorical_values.items():
+                # TODO: remove this
+                selected_values = pd.Index(values)[self.masks[feature][index]].astype(float).tolist()
+                current_result['features'][name_mapping(feature)] = selected_values
             result.append(current_result)
         return result
 
@@ -139,19 +213,18 @@ class ScoredSlices:
 
     @staticmethod
     def from_dict(dictionary):
-        continuous = {
-            name: pd.DataFrame(description) for name, description in dictionary['continuous'].items()
-        }
-        categorical = {
-            name: pd.DataFrame(description) for name, description in dictionary['categorical'].items()
-        }
-        scores_series = pd.Series(dictionary['scores'])
-
-        slices = ScoredSlices([], [], to_keep=dictionary['to_keep'], threshold=dictionary['threshold'])
-        slices.categorical = categorical
-        slices.continuous = continuous
-        slices.scores = scores_series
-
+        categorical = [{'name': name, 'values': list(description)}
+                       for name, description in dictionary['categorical'].items()]
+        slices = ScoredSlices(categorical, list(dictionary['continuous']), to_keep=dictionary['to_keep'],
+                              threshold=dictionary['threshold'])
+
+        slices.add_from_dict({
+            'scores': dictionary['scores'],
+            'features': {
+                **dictionary['continuous'],
+                **{name: np.array(list(description.values()), dtype=bool).reshape(len(description), -1).T
+                   for name, description in dictionary['categorical'].items()}}
+        })
         return slices
 
     @staticmethod
@@ -4,68 +4,116 @@ import numpy as np
 import pandas as pd
 
 
-def continuous_similarity_matrix(dfs):
-    if dfs:
-        length = len(list(dfs.values())[0])
-    else:
-        length = 0
-
-    volumn = np.zeros((length, length))
-    overlap = np.zeros((length, length))
-
-    for index, df in dfs.items():
-        end = np.array([df['to_value']] * length)
-        start = np.array([df['from_value']] * length)
-        min_range = np.minimum((end - start), (end - start).T)
-        min_overlap_range = np.minimum((end.T - start), (end.T - start).T)
-
-        if not overlap.any():
-            overlap = np.minimum(min_range, min_overlap_range)
-        else:
-            overlap = overlap * np.minimum(min_range, min_overlap_range)
-        overlap[overlap < 0] = 0
-
-        if not volumn.any():
-            volumn = end - start
+def _restarted_product(factors):
+    """Column-wise running product of factors (slices x features) as the similarity matrices build it: the
+    product restarts at a feature whenever it is zero for all slices. Returns the feature it last restarted at and
+    the product
+    """
+    product = np.zeros(len(factors))
+    start = 0
+    for feature in range(factors.shape[1]):
+        if not product.any():
+            product = factors[:, feature].copy()
+            start = feature
         else:
-            volumn = volumn * (end - start)
-
-    min_volumn = np.maximum(volumn, volumn.T)
-
-    min_volumn[min_volumn <= 0] = 1
-    overlap[overlap < 0] = 0
-
-    return overlap / min_volumn
-
-
-def categorical_similarity_matrix(dfs):
+            product = product * factors[:, feature]
+    return start, product
+
+
+def continuous_similarity_matrix(dfs, block_size=None):
+    """Overlap of the ranges of every pair of slices relative to the larger range, multiplied over the features.
+    Computed by broadcasting the bounds for block_size rows at a time if given, so that temporaries stay at
+    block_size x slices
+    """
+    if not dfs:
+        return np.zeros((0, 0))
+
+    from_values = np.stack([np.asarray(df['from_value'], dtype=float) for df in dfs.values()], axis=1)
+    to_values = np.stack([np.asarray(df['to_value'], dtype=float) for df in dfs.values()], axis=1)
+    lengths = to_values - from_values
+    start, volume = _restarted_product(lengths)
+    length = len(lengths)
+
+    block_size = block_size or max(length, 1)
+    similarity = np.zeros((length, length))
+    for block_start in range(0, length, block_size):
+        rows = slice(block_start, block_start + block_size)
+        overlap = np.ones((len(volume[rows]), length))
+        for feature in range(start, lengths.shape[1]):
+            current_overlap = np.minimum(np.minimum(lengths[rows, feature, None], lengths[None, :, feature]),
+                                         np.minimum(to_values[rows, feature, None] - from_values[None, :, feature],
+                                                    to_values[None, :, feature] - from_values[rows, feature, None]))
+            overlap *= np.maximum(current_overlap, 0, out=current_overlap)
+
+        min_volume = np.maximum(volume[rows, None], volume[None, :])
+        min_volume[min_volume <= 0] = 1
+        similarity[rows] = overlap / min_volume
+
+    return similarity
+
+
+def categorical_similarity_matrix(dfs, block_size=None):
+    """Overlap of the selected values of every pair of slices relative to the smaller slice, multiplied over the
+    features. Overlaps are products A @ A.T of the (slices x values) indicator matrices, computed for block_size
+    rows at a time if given, so that temporaries stay at block_size x slices
+    """
     if dfs:
         length = len(list(dfs.values())[0])
     else:
         length = 0
 
-    volumn = np.zeros((length, length))
-    overlap = np.zeros((length, length))
-
-    for index, df in dfs.items():
-
-        data_array = np.array([np.array(df).tolist()] * len(df))
-        size_array = np.apply_along_axis(lambda x: (x * 1).sum(), 2, data_array)
-
-        current_overlap = np.apply_along_axis(lambda x: (x * 1).sum(), 2,
-                                              np.logical_and(data_array, data_array.transpose(1, 0, 2)))
-
-        if not overlap.any():
-            overlap = current_overlap
-        else:
-            overlap = overlap * current_overlap
-
-        if not volumn.any():
-            volumn = size_array
-        else:
-            volumn = volumn * size_array
-
-    min_volumn = np.minimum(volumn, volumn.T)
-    min_volumn[min_volumn == 0] = 1
-
-    return overlap / min_volumn
+    indicators = [np.asarray(df) for df in dfs.values()]
+    sizes = np.stack([(indicator * 1).sum(axis=1) for indicator in indicators], axis=1) if indicators \
+        else np.zeros((length, 0), dtype=int)
+    start, volume = _restarted_product(sizes)
+    indicators = [(indicator != 0).astype(float) for indicator in indicators[start:]]
+
+    block_size = block_size or max(length, 1)
+    similarity = np.zeros((length, length))
+    for block_start in range(0, length, block_size):
+        rows = slice(block_start, block_start + block_size)
+        overlap = np.ones((len(volume[rows]), length))
+        for indicator in indicators:
+            overlap *= indicator[rows] @ indicator.T
+
+        min_volume = np.minimum(volume[rows, None], volume[None, :])
+        min_volume[min_volume == 0] = 1
+        similarity[rows] = overlap / min_volume
+
+    return similarity
+
+
+def continuous_similarities(from_values, to_values, row, candidates):
+    """Equals continuous_similarity_matrix(...)[row, candidates] for bounds given as (slices x features) arrays,
+    in O(len(candidates) * features) instead of building the full matrix
+    """
+    lengths = to_values - from_values
+    start, volume = _restarted_product(lengths)
+
+    overlap = np.ones(len(candidates))
+    for feature in range(start, lengths.shape[1]):
+        from_value, to_value = from_values[candidates, feature], to_values[candidates, feature]
+        current_overlap = np.minimum(np.minimum(lengths[row, feature], lengths[candidates, feature]),
+                                     np.minimum(to_values[row, feature] - from_value,
+                                                to_value - from_values[row, feature]))
+        overlap = overlap * np.maximum(current_overlap, 0)
+
+    min_volume = np.maximum(volume[row], volume[candidates])
+    min_volume[min_volume <= 0] = 1
+    return overlap / min_volume
+
+
+def categorical_similarities(masks, row, candidates):
+    """Equals categorical_similarity_matrix(...)[row, candidates] for a list of boolean (slices x values) arrays,
+    one per feature, in O(len(candidates) * values) instead of building the full matrix
+    """
+    sizes = np.stack([mask.sum(axis=1) for mask in masks], axis=1)
+    start, volume = _restarted_product(sizes)
+
+    overlap = np.ones(len(candidates), dtype=sizes.dtype)
+    for mask in masks[start:]:
+        overlap = overlap * np.logical_and(mask[candidates], mask[row]).sum(axis=1)
+
+    min_volume = np.minimum(volume[row], volume[candidates])
+    min_volume[min_volume == 0] = 1
+    return overlap / min_volume
@@ -0,0 +1,12 @@
+import numpy as np
+import pandas as pd
+
+
+def correlated_data(rows=600, seed=0, columns=('x1', 'x2', 'c1', 'noise')):
+  """Continuous columns and categorical c-columns with four values, x1 and c1 determine the binary target y
+  """
+  random_state = np.random.RandomState(seed)
+  data = pd.DataFrame({column: random_state.randint(0, 4, rows) if column.startswith('c') else random_state.rand(rows)
+                       for column in columns})
+  data['y'] = (data.x1 + 0.3 * data.c1 + 0.3 * random_state.rand(rows) > 1).astype(int)
+  return data
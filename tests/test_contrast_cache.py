@@ -0,0 +1,62 @@
+from unittest import TestCase
+from hics.contrast_cache import ContrastCache
+from hics.contrast_measure import HiCS
+from hics.incremental_correlation import IncrementalCorrelation
+from hics.result_storage import DefaultResultStorage
+import numpy as np
+import unittest
+from fixtures import correlated_data
+
+class Test_contrast_cache(TestCase):
+  def test_hits_and_misses(self):
+    cache = ContrastCache(min_iterations=20)
+    contrast = HiCS(correlated_data(500, columns=('x1', 'c1')), 0.1, 10, contrast_cache=cache)
+
+    # Entries are hits once they accumulated min_iterations slices
+    first = contrast.calculate_contrast(['x1'], 'y')
+    second = contrast.calculate_contrast(['x1'], 'y')
+    self.assertTrue(cache.misses == 2 and cache.hits == 0)
+    self.assertTrue(contrast.last_iterations == 10 and contrast.last_cached_iterations == 0)
+
+    third = contrast.calculate_contrast(['x1'], 'y')
+    self.assertTrue(cache.misses == 2 and cache.hits == 1)
+    self.assertTrue(np.isclose(third, (first + second) / 2))
+    self.assertTrue(contrast.last_iterations == 0 and contrast.last_cached_iterations == 10)
+
+    # Subspaces are keyed independent of the feature order, targets are part of the key
+    contrast.calculate_contrast(['x1', 'c1'], 'y')
+    contrast.calculate_contrast(['c1', 'x1'], 'y')
+    contrast.calculate_contrast(['x1'], 'c1')
+    self.assertTrue(len(cache.entries) == 3)
+
+  def test_eviction(self):
+    entry_size = ContrastCache().add(('a',), 0.5, 10)['size']
+    cache = ContrastCache(max_memory=2 * entry_size, min_iterations=10)
+    for key in [('a',), ('b',), ('a',), ('c',)]:
+      if cache.get(key) is None:
+        cache.add(key, 0.5, 10)
+
+    # ('b',) was least recently used
+    self.assertTrue(list(cache.entries) == [('a',), ('c',)])
+    self.assertTrue(cache.memory == sum(entry['size'] for entry in cache.entries.values()) <= cache.max_memory)
+
+    cache.add(('d',), 0.5, 10, slices={'scores': list(range(10 ** 5))})
+    self.assertTrue(('d',) not in cache.entries)
+
+  def test_hits_add_no_weight(self):
+    data = correlated_data(500, columns=('x1', 'c1'))
+    correlation = IncrementalCorrelation(data, 'y', DefaultResultStorage(['x1', 'c1']), contrast_cache=ContrastCache())
+    correlation.update_bivariate_relevancies(runs=5)
+    self.assertTrue(correlation.result_storage.get_relevancies().iteration.tolist() == [1.0, 1.0])
+
+    # A new storage counts a cached contrast once
+    reused = IncrementalCorrelation(data, 'y', DefaultResultStorage(['x1', 'c1']),
+                                    contrast_cache=correlation.subspace_contrast.contrast_cache)
+    reused.update_bivariate_relevancies(runs=2)
+    relevancies = reused.result_storage.get_relevancies()
+    self.assertTrue(relevancies.iteration.tolist() == [1.0, 1.0])
+    self.assertTrue(np.allclose(relevancies.relevancy, correlation.result_storage.get_relevancies().relevancy))
+
+
+if __name__ == '__main__':
+  unittest.main()
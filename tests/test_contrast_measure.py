@@ -0,0 +1,173 @@
+from unittest import TestCase
+from hics.contrast_measure import HiCS, set_bit_positions
+import numpy as np
+import random
+import pandas as pd
+import unittest
+from fixtures import correlated_data
+
+
+class LabelBasedSlices:
+  # Slice conditions and conditional distributions of the original HiCS, on index labels instead of row positions
+
+  def __init__(self, data):
+    self.data = data
+    self.index_lookup = pd.Series(np.arange(len(data)), index=data.index)
+
+  def marginal_distribution(self, feature):
+    values, counts = np.unique(self.data[feature], return_counts=True)
+    return pd.DataFrame({'value': values, 'count': counts, 'probability': counts / len(self.data)})
+
+  def create_categorical_condition(self, feature, instances_per_dimension):
+    feature_distribution = self.marginal_distribution(feature)
+    selected_values = []
+    current_sum = 0
+    for value in np.random.permutation(feature_distribution['value']):
+      if current_sum >= instances_per_dimension:
+        break
+      selected_values.append(value)
+      current_sum += feature_distribution.loc[feature_distribution['value'] == value, 'count'].values[0]
+
+    indices = self.data.loc[self.data[feature].isin(selected_values)].index.tolist()
+    return {'feature': feature, 'indices': indices, 'values': selected_values}
+
+  def create_continuous_condition(self, feature, instances_per_dimension):
+    sorted_feature = self.data.sort_values(by=feature, kind='mergesort').index.values
+    start = random.randint(0, len(sorted_feature) - instances_per_dimension)
+    end = start + (instances_per_dimension - 1)
+
+    start_value = self.data.loc[sorted_feature[start], feature]
+    end_value = self.data.loc[sorted_feature[end], feature]
+    inside = (self.data[feature] >= start_value) & (self.data[feature] <= end_value)
+    return {'feature': feature, 'indices': self.data.loc[inside].index.tolist(), 'from_value': start_value,
+            'to_value': end_value}
+
+  def calculate_conditional_distribution(self, slice_conditions, target):
+    filter_array = np.ones(len(self.data), dtype=bool)
+    for slice_condition in slice_conditions:
+      condition_filter = np.zeros(len(self.data), dtype=bool)
+      condition_filter[self.index_lookup[slice_condition['indices']].values] = True
+      filter_array &= condition_filter
+
+    values, counts = np.unique(self.data.loc[filter_array, target], return_counts=True)
+    return pd.DataFrame({'value': values, 'count': counts, 'probability': counts / filter_array.sum()})
+
+
+class Test_contrast_measure(TestCase):
+  def test_label_based_reference(self):
+    # Shuffled non-range labels and continuous values with ties
+    random_state = np.random.RandomState(0)
+    data = correlated_data(500)
+    data['x1'] = data.x1.round(2)
+    data.index = random_state.permutation(len(data)) * 3 + 7
+    contrast = HiCS(data, 0.1, 10)
+    reference = LabelBasedSlices(data)
+
+    for seed in range(20):
+      conditions = []
+      for implementation in (contrast, reference):
+        np.random.seed(seed)
+        random.seed(seed)
+        conditions.append([implementation.create_categorical_condition('c1', 120),
+                           implementation.create_continuous_condition('x1', 120),
+                           implementation.create_continuous_condition('noise', 200)])
+
+      for condition, expected in zip(*conditions):
+        self.assertTrue(sorted(condition['indices']) == sorted(reference.index_lookup[expected['indices']]))
+        for key in ('values', 'from_value', 'to_value'):
+          self.assertTrue(condition.get(key) == expected.get(key))
+
+      for target in ('y', 'x2'):
+        distribution = contrast.calculate_conditional_distribution(conditions[0], target)
+        expected = reference.calculate_conditional_distribution(conditions[1], target)
+        self.assertTrue(np.array_equal(distribution.value.values, expected.value.values))
+        self.assertTrue(np.array_equal(distribution['count'].values, expected['count'].values))
+        self.assertTrue(np.allclose(distribution.probability.values, expected.probability.values))
+
+  def test_batched_distribution(self):
+    data = correlated_data(1000)
+    contrasts = {}
+    for batched in (False, True):
+      contrast = HiCS(data, 0.1, 20, batched=batched)
+      contrasts[batched] = []
+      for seed in range(30):
+        random.seed(seed)
+        np.random.seed(seed)
+        contrasts[batched].append(contrast.calculate_contrast(['x1', 'c1'], 'y'))
+
+    sequential, batched = np.array(contrasts[False]), np.array(contrasts[True])
+    standard_error = np.sqrt((sequential.var() + batched.var()) / len(sequential))
+    self.assertTrue(abs(sequential.mean() - batched.mean()) < 3 * standard_error)
+    self.assertTrue(abs(sequential.std() - batched.std()) < 0.5 * sequential.std())
+
+  def test_bitset_masks(self):
+    data = correlated_data(1000)
+    positions = HiCS(data, 0.1, 20)
+    bitsets = HiCS(data, 0.1, 20, bitset_masks=True)
+
+    rows = np.array([0, 5, 63, 64, 130, 999])
+    bits = np.unpackbits(bitsets.packed_bitset(rows).view(np.uint8), bitorder='little')
+    self.assertTrue(np.flatnonzero(bits).tolist() == rows.tolist())
+    self.assertTrue(sorted(set_bit_positions(bitsets.packed_bitset(rows))) == rows.tolist())
+
+    for seed in range(10):
+      np.random.seed(seed)
+      random.seed(seed)
+      conditions = positions.create_slice_conditions(['x1', 'c1', 'x2'], 400)
+      for target in ('y', 'noise'):
+        expected = np.sort(positions.calculate_slice_sample(conditions, target))
+        self.assertTrue(np.array_equal(np.sort(bitsets.calculate_slice_sample(conditions, target)), expected))
+    # The membership mask of the positions path is kept between slices and left cleared
+    self.assertTrue(len(positions.membership) == 1000 and not positions.membership.any())
+
+  def test_append_rows(self):
+    data = correlated_data(400)
+    rows = correlated_data(100, seed=1)
+    # New values of a categorical feature
+    rows.loc[rows.index[:10], 'c1'] = 7
+
+    appended = HiCS(data, 0.1, 20, bitset_masks=True)
+    appended.precompute(list(appended.types))
+    appended.append_rows(rows)
+    rebuilt = HiCS(pd.concat([data, rows]), 0.1, 20, bitset_masks=True)
+    rebuilt.precompute(list(rebuilt.types))
+
+    self.assertTrue(appended.data is None and appended.rows == 500)
+    for feature in appended.types:
+      self.assertTrue(np.array_equal(appended.columns[feature], rebuilt.columns[feature]))
+      for a, b in zip(appended.cached_codes(feature), rebuilt.cached_codes(feature)):
+        self.assertTrue(np.array_equal(a, b))
+      self.assertTrue(np.array_equal(appended.marginal_counts[feature], rebuilt.marginal_counts[feature]))
+      self.assertTrue(appended.cached_marginal_distribution(feature).equals(
+          rebuilt.cached_marginal_distribution(feature)))
+
+      if appended.types[feature] == 'continuous':
+        self.assertTrue(np.array_equal(appended.sorted_indices[feature], rebuilt.sorted_indices[feature]))
+        self.assertTrue(np.array_equal(appended.sorted_values[feature], rebuilt.sorted_values[feature]))
+      else:
+        for a, b in zip(appended.value_indices[feature], rebuilt.value_indices[feature]):
+          self.assertTrue(np.array_equal(a, b))
+        self.assertTrue(np.array_equal(appended.cached_class_bitsets(feature), rebuilt.cached_class_bitsets(feature)))
+
+    scores = []
+    for contrast in (appended, rebuilt):
+      random.seed(0)
+      np.random.seed(0)
+      scores.append(contrast.calculate_contrast(['x1', 'c1'], 'y'))
+    self.assertTrue(scores[0] == scores[1])
+
+  def test_adaptive_iterations(self):
+    contrast = HiCS(correlated_data(1000), 0.1, 100, adaptive_tolerance=0.02, min_iterations=10)
+    iterations = {}
+    for subspace in (['noise'], ['x2'], ['x1', 'c1']):
+      random.seed(0)
+      np.random.seed(0)
+      contrast.calculate_contrast(subspace, 'y')
+      iterations[subspace[0]] = contrast.last_iterations
+
+    # Uncorrelated subspaces converge after the first check, the correlated one needs all slices
+    self.assertTrue(iterations == {'noise': 10, 'x2': 10, 'x1': 100})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,38 @@
+from unittest import TestCase
+from hics.divergences import KLD, KS, kld_matrix, ks_matrix
+import numpy as np
+import pandas as pd
+
+
+class Test_divergences(TestCase):
+  def test_kld_matrix(self):
+    P = pd.DataFrame({'value': [0, 2, 5], 'count': [3, 1, 6], 'probability': [0.3, 0.1, 0.6]})
+    Q = pd.DataFrame({'value': [0, 1, 2, 5], 'count': [3, 1, 1, 5], 'probability': [0.3, 0.1, 0.1, 0.5]})
+
+    divergences, binary_divergences = KLD(P, Q, wrar=True)
+    class_scores, binary_scores = kld_matrix(np.array([[0.3, 0.1, 0.6]] * 2), np.array([0.3, 0.1, 0.5]), wrar=True)
+
+    self.assertTrue(class_scores.shape == (2, 3))
+    self.assertTrue(np.allclose(class_scores[1], [divergences[value] for value in [0, 2, 5]]))
+    self.assertTrue(np.allclose(binary_scores[1], [binary_divergences[value] for value in [0, 2, 5]]))
+
+  def test_ks_matrix(self):
+    sample = np.array([1, 1, 2, 2, 2, 3, 4, 4, 5, 6])
+    values, codes = np.unique(sample, return_inverse=True)
+    marginal_cdf = np.cumsum(np.bincount(codes)) / len(sample)
+    slices = [np.array([0, 1]), np.array([2, 3, 4, 5]), np.array([8, 9, 6])]
+
+    distances = ks_matrix(marginal_cdf, np.concatenate([codes[s] for s in slices]),
+                          np.array([len(s) for s in slices]))
+
+    self.assertTrue(np.allclose(distances, [0.8, 0.4, 0.6]))
+
+    marginal = pd.DataFrame({'value': values, 'count': np.bincount(codes)})
+    for s, distance in zip(slices, distances):
+      slice_values, slice_counts = np.unique(sample[s], return_counts=True)
+      conditional = pd.DataFrame({'value': slice_values, 'count': slice_counts})
+      self.assertAlmostEqual(KS(marginal, conditional), distance)
+
+
+if __name__ == '__main__':
+  unittest.main()
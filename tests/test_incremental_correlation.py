@@ -0,0 +1,140 @@
+from unittest import TestCase
+from hics.incremental_correlation import IncrementalCorrelation
+from hics.result_storage import DefaultResultStorage
+import numpy as np
+import pandas as pd
+import resource
+import unittest
+from fixtures import correlated_data
+
+
+def new_correlation(data, **kwargs):
+  features = [feature for feature in data.columns if feature != 'y']
+  return IncrementalCorrelation(data, 'y', DefaultResultStorage(features), iterations=20, **kwargs)
+
+
+def reference_redundancy_table(features, new_redundancies):
+  # Previous row-by-row implementation of IncrementalCorrelation._update_redundancy_table
+  bivariate_redundancies = pd.DataFrame(data=np.inf, columns=features, index=features)
+  bivariate_weights = pd.DataFrame(data=0.0, columns=features, index=features)
+  for row in new_redundancies.itertuples():
+    subspace, target = row.Index
+    for ft in subspace:
+      redundancy = min(bivariate_redundancies.loc[ft, target], row.redundancy)
+      bivariate_redundancies.loc[ft, target] = redundancy
+      bivariate_redundancies.loc[target, ft] = redundancy
+      bivariate_weights.loc[ft, target] = bivariate_weights.loc[ft, target] + row.iteration
+      bivariate_weights.loc[target, ft] = bivariate_weights.loc[target, ft] + row.iteration
+  return bivariate_redundancies, bivariate_weights
+
+
+class Test_incremental_correlation(TestCase):
+  def test_n_jobs(self):
+    data = correlated_data()
+    results = []
+    for n_jobs in (1, 2):
+      with new_correlation(data, n_jobs=n_jobs, seed=3) as correlation:
+        correlation.update_multivariate_relevancies(k=3, runs=12)
+        pool = correlation.pool
+        correlation.update_redundancies(k=2, runs=12)
+        # The worker pool is reused by all updates
+        self.assertTrue(correlation.pool is pool)
+      self.assertTrue(correlation.pool is None)
+      results.append((correlation.result_storage.get_relevancies(), correlation.result_storage.get_redundancies()))
+
+    for sequential, parallel in zip(*results):
+      self.assertTrue(sequential.index.tolist() == parallel.index.tolist())
+      self.assertTrue(np.allclose(sequential.values.astype(float), parallel.values.astype(float)))
+
+  def test_n_jobs_wide_data(self):
+    # All cached columns share one memory segment, so wide data stays far below the open file limit
+    random_state = np.random.RandomState(0)
+    data = pd.DataFrame(random_state.rand(200, 120), columns=['x{}'.format(i) for i in range(120)])
+    data['y'] = (data.x0 > 0.5).astype(int)
+
+    limits = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(256, limits[0]), limits[1]))
+    try:
+      results = []
+      for n_jobs in (1, 2):
+        with new_correlation(data, n_jobs=n_jobs, seed=0) as correlation:
+          correlation.update_multivariate_relevancies(k=3, runs=8)
+        results.append(correlation.result_storage.get_relevancies())
+    finally:
+      resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+
+    self.assertTrue(results[0].index.tolist() == results[1].index.tolist())
+    self.assertTrue(np.allclose(results[0].values.astype(float), results[1].values.astype(float)))
+
+  def test_configure(self):
+    data = correlated_data()
+    correlation = new_correlation(data, seed=3)
+    correlation.update_multivariate_relevancies(k=2, runs=4)
+    seed_sequence = correlation.seed_sequence
+
+    correlation.configure(seed=3, iterations=50, adaptive_tolerance=0.02, min_iterations=20)
+    contrast = correlation.subspace_contrast
+    self.assertTrue((contrast.iterations, contrast.adaptive_tolerance, contrast.min_iterations) == (50, 0.02, 20))
+    # The same seed continues the random streams, another one restarts them
+    self.assertTrue(correlation.seed_sequence is seed_sequence)
+    correlation.configure(seed=4)
+    self.assertTrue(correlation.seed_sequence.entropy == 4 and contrast.iterations == 10)
+
+  def test_redundancy_table(self):
+    correlation = new_correlation(correlated_data())
+    features = correlation.features
+    # Duplicate pairs within and across rows, and a pair seen from both directions
+    index = [(('x1',), 'x2'), (('x1', 'c1'), 'x2'), (('x2',), 'x1'), (('c1', 'noise'), 'x1'), (('noise',), 'c1')]
+    new_redundancies = pd.DataFrame({'redundancy': [0.5, 0.25, 0.75, 0.5, 0.125],
+                                     'iteration': [2.0, 3.0, 1.0, 4.0, 5.0]},
+                                    index=pd.Index(index, tupleize_cols=False))
+    correlation._update_redundancy_table(new_redundancies)
+
+    reference = DefaultResultStorage(features)
+    reference.update_bivariate_redundancies(*reference_redundancy_table(features, new_redundancies))
+    redundancies, weights = correlation.result_storage.get_bivariate_redundancies()
+    expected_redundancies, expected_weights = reference.get_bivariate_redundancies()
+    self.assertTrue(np.array_equal(redundancies.values, expected_redundancies.values))
+    self.assertTrue(np.array_equal(weights.values, expected_weights.values))
+    self.assertTrue(redundancies.loc['x1', 'x2'] == redundancies.loc['x2', 'x1'] == 0.25)
+    self.assertTrue(weights.loc['x1', 'x2'] == weights.loc['x2', 'x1'] == 6)
+    self.assertTrue(np.array_equal(redundancies.values, redundancies.values.T))
+
+  def test_append_rows(self):
+    data = correlated_data()
+    correlation = new_correlation(data.iloc[:400], seed=0)
+    correlation.update_multivariate_relevancies(k=2, runs=10)
+    correlation.update_redundancies(k=2, runs=10)
+    relevancies = correlation.result_storage.get_relevancies()
+    redundancies = correlation.result_storage.get_redundancies()
+    _, weights = correlation.result_storage.get_bivariate_redundancies()
+
+    correlation.append_rows(data.iloc[400:])
+    self.assertTrue(correlation.subspace_contrast.rows == 600)
+    # Results are kept, their weights scaled by the share of old rows
+    discounted = correlation.result_storage.get_relevancies()
+    self.assertTrue(np.allclose(discounted.relevancy, relevancies.relevancy))
+    self.assertTrue(np.allclose(discounted.iteration, relevancies.iteration * 400 / 600))
+    self.assertTrue(np.allclose(correlation.result_storage.get_redundancies().iteration,
+                                redundancies.iteration * 400 / 600))
+    self.assertTrue(np.allclose(correlation.result_storage.get_bivariate_redundancies()[1], weights * 400 / 600))
+
+    correlation.update_multivariate_relevancies(k=2, runs=10)
+    self.assertTrue(correlation.result_storage.get_relevancies().iteration.sum() > discounted.iteration.sum())
+
+  def test_adaptive_weights(self):
+    data = correlated_data(1000)
+    features = [feature for feature in data.columns if feature != 'y']
+    correlation = IncrementalCorrelation(data, 'y', DefaultResultStorage(features), iterations=100,
+                                         adaptive_tolerance=0.02, min_iterations=10, seed=0)
+    correlation.update_bivariate_relevancies(runs=2)
+
+    # Runs weigh by the share of the 100 slices they used
+    iterations = correlation.result_storage.get_relevancies().iteration
+    self.assertTrue(np.allclose(iterations[[('noise',)]], 0.2))
+    self.assertTrue(np.allclose(iterations[[('x2',)]], 0.2))
+    self.assertTrue(np.allclose(iterations[[('x1',)]], 2))
+
+
+if __name__ == '__main__':
+  unittest.main()
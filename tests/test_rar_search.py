@@ -0,0 +1,72 @@
+from unittest import TestCase
+from wrar.rar import RaR
+from wrar.rar_search import RankingStability
+from wrar.solvers import QPSolver
+import contextlib
+import io
+import os
+import numpy as np
+import pandas as pd
+import random
+import tempfile
+
+
+def two_feature_data(rows=2000, seed=0):
+  # Eight uniform features, only f0 and f1 determine the target
+  random_state = np.random.RandomState(seed)
+  data = pd.DataFrame({'f{}'.format(i): random_state.rand(rows) for i in range(8)})
+  data['y'] = ((data.f0 + data.f1 + 0.2 * random_state.rand(rows)) > 1.1).astype(int)
+  return data
+
+
+class Test_rar_search(TestCase):
+  def test_ties_lower_similarity(self):
+    stability = RankingStability(top_k=3, measure='overlap')
+    # Five features tied at the cutoff, as long as they were never sampled apart
+    tied = {'a': 1.0, 'b': 1.0, 'c': 1.0, 'd': 1.0, 'e': 1.0, 'f': 0.1}
+    self.assertAlmostEqual(stability.similarity(tied, tied), 0.6)
+    resolved = {'a': 1.0, 'b': 0.9, 'c': 0.8, 'd': 0.2, 'e': 0.1, 'f': 0.0}
+    self.assertEqual(stability.similarity(resolved, resolved), 1)
+
+    stability = RankingStability(top_k=3)
+    self.assertLess(stability.similarity(tied, tied), stability.threshold)
+    self.assertEqual(stability.similarity(resolved, resolved), 1)
+    self.assertEqual(stability.similarity(resolved, {f: -r for f, r in resolved.items()}), -1)
+
+  def test_sampled(self):
+    stability = RankingStability(min_samples=2, min_runs=2)
+    features = ['a', 'b', 'c']
+    self.assertFalse(stability.sampled([('a', 'b'), ('a', 'b')], features, runs=2))
+    self.assertFalse(stability.sampled([('a', 'b'), ('b', 'c'), ('a', 'c')], features, runs=1))
+    self.assertTrue(stability.sampled([('a', 'b'), ('b', 'c'), ('a', 'c')], features, runs=2))
+
+  def test_stopping_finds_relevant_features(self):
+    for seed in range(3):
+      random.seed(seed)
+      np.random.seed(seed)
+      rar = RaR(two_feature_data(seed=seed))
+      with contextlib.redirect_stdout(io.StringIO()):
+        rar.run('y', k=2, seed=seed, solver=QPSolver(), stopping=RankingStability(top_k=2))
+      self.assertEqual({feature for feature, _ in rar.feature_ranking[:2]}, {'f0', 'f1'})
+
+  def test_stopping_with_cost_matrix(self):
+    random.seed(0)
+    np.random.seed(0)
+    rar = RaR(two_feature_data())
+    with contextlib.redirect_stdout(io.StringIO()):
+      rar.run('y', k=2, seed=0, compensate_imbalance=True, solver=QPSolver(),
+              stopping=RankingStability(top_k=2, max_runs=20))
+    self.assertEqual({feature for feature, _ in rar.feature_ranking[:2]}, {'f0', 'f1'})
+    # The class scores of the storage keep their single row
+    self.assertTrue(all(len(scores) == 1 for scores in rar.correlation.result_storage.get_relevancies().relevancy))
+
+  def test_storage_path_of_later_runs(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'results.sqlite')
+      rar = RaR(two_feature_data(rows=300))
+      with contextlib.redirect_stdout(io.StringIO()):
+        rar.run('y', k=2, runs=4, seed=0, solver=QPSolver(), storage_path=path)
+        rar.run('y', k=2, runs=4, seed=0, solver=QPSolver(), storage_path=path)
+        with self.assertRaises(ValueError):
+          rar.run('y', k=2, runs=4, seed=0, solver=QPSolver(), storage_path=os.path.join(directory, 'other.sqlite'))
+      rar.correlation.result_storage.close()
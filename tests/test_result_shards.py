@@ -0,0 +1,69 @@
+from unittest import TestCase
+from hics.result_shards import merge_shards, read_shard, write_shard
+from hics.result_storage import DefaultResultStorage
+from hics.scored_slices import ScoredSlices
+import numpy as np
+import pandas as pd
+import os
+import pickle
+import tempfile
+import unittest
+
+
+def worker_storage(features, relevancies, iterations, slice_scores):
+  storage = DefaultResultStorage(features)
+  storage.accumulate_relevancies(pd.DataFrame({'relevancy': relevancies, 'iteration': iterations},
+                                              index=[('X1',), ('X1', 'X2')]))
+  storage.update_redundancies(pd.DataFrame({'redundancy': [relevancies[0]], 'iteration': [iterations[0]]},
+                                           index=[(('X1',), 'X2')]))
+  slices = ScoredSlices([], ['X1'])
+  slices.add_slices({'features': {'X1': {'from_value': [0] * len(slice_scores), 'to_value': slice_scores}},
+                     'scores': slice_scores})
+  storage.update_slices({('X1',): slices})
+  return storage
+
+
+class Test_result_shards(TestCase):
+  def test_merge_shards(self):
+    features = ['X1', 'X2']
+    directory = tempfile.mkdtemp()
+    write_shard(worker_storage(features, [0.5, 0.25], [2.0, 1.0], [0.5]), os.path.join(directory, 'a.shard'))
+    write_shard(worker_storage(features, [0.75, 1.0], [2.0, 3.0], [0.9, 0.1]), os.path.join(directory, 'b.shard'))
+
+    merged = merge_shards(directory)
+    relevancies = merged.get_relevancies()
+    self.assertTrue(np.allclose(relevancies.relevancy, [0.625, 0.8125]))
+    self.assertTrue(np.allclose(relevancies.iteration, [4, 4]))
+    self.assertTrue(np.allclose(merged.get_redundancies().redundancy, [0.625]))
+    self.assertTrue(merged.get_slices()[('X1',)].scores.tolist() == [0.9, 0.5, 0.1])
+
+    write_shard(DefaultResultStorage(['X1', 'X3']), os.path.join(directory, 'c.shard'))
+    with self.assertRaises(ValueError):
+      merge_shards(directory)
+
+  def test_shard_round_trip(self):
+    features = [1, 2]
+    storage = DefaultResultStorage(features)
+    class_scores = pd.DataFrame([[0.25, 0.75]], index=[0], columns=[0, 1])
+    storage.accumulate_relevancies(pd.DataFrame({'relevancy': [class_scores], 'iteration': [2.0]}, index=[(1,)]))
+    slices = ScoredSlices([{'name': 2, 'values': [3, 4]}], [1], 2, 0.1)
+    slices.add_slices({'features': {1: {'from_value': [0.5, 0], 'to_value': [1, 0.5]}, 2: [[1, 0], [0, 1]]},
+                       'scores': [1, 2]})
+    storage.update_slices({(1, 2): slices})
+
+    path = os.path.join(tempfile.mkdtemp(), 'a.shard')
+    write_shard(storage, path)
+    merged = merge_shards([path])
+    relevancy = merged.get_relevancies().relevancy[[(1,)]].iloc[0]
+    self.assertTrue(relevancy.equals(class_scores.astype(float)))
+    self.assertTrue(merged.get_slices()[(1, 2)].to_dict() == slices.to_dict())
+
+    # Shards are never unpickled
+    with open(path, 'wb') as file:
+      pickle.dump({'version': 1}, file)
+    with self.assertRaises(ValueError):
+      read_shard(path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,108 @@
+from unittest import TestCase
+from hics.result_storage import DefaultResultStorage, RunningMeans, SQLiteResultStorage
+from hics.scored_slices import ScoredSlices
+import numpy as np
+import pandas as pd
+import os
+import pickle
+import tempfile
+import unittest
+
+
+class Test_result_storage(TestCase):
+  def test_running_means(self):
+    means = RunningMeans('relevancy')
+    means.add([('X1',), ('X1', 'X2')], [0.5, 0.25], [2, 1])
+    means.add([('X1', 'X2'), ('X3',)], [1.0, 0.75], [3, 1])
+    means.discount(0.5)
+
+    frame = means.frame()
+    self.assertTrue(frame.index.tolist() == [('X1',), ('X1', 'X2'), ('X3',)])
+    self.assertTrue(np.allclose(frame.relevancy, [0.5, 0.8125, 0.75]))
+    self.assertTrue(np.allclose(frame.iteration, [1, 2, 0.5]))
+
+  def test_bivariate_redundancies(self):
+    features = ['X1', 'X2']
+    storage = DefaultResultStorage(features)
+    for redundancy, weight in [(0.5, 2), (np.inf, 0), (0.25, 1)]:
+      redundancies = pd.DataFrame(np.inf, index=features, columns=features)
+      weights = pd.DataFrame(0, index=features, columns=features)
+      redundancies.loc['X1', 'X2'] = redundancy
+      weights.loc['X1', 'X2'] = weight
+      storage.update_bivariate_redundancies(redundancies, weights)
+
+    redundancies, weights = storage.get_bivariate_redundancies()
+    self.assertTrue(redundancies.loc['X1', 'X2'] == 0.25 and weights.loc['X1', 'X2'] == 3)
+    self.assertTrue(redundancies.loc['X2', 'X1'] == 0 and weights.loc['X2', 'X1'] == 0)
+
+  def test_sqlite_resume(self):
+    features = ['X1', 'X2', 'X3']
+    path = os.path.join(tempfile.mkdtemp(), 'results.sqlite')
+
+    storage = SQLiteResultStorage(path, features)
+    storage.update_relevancies(pd.DataFrame({'relevancy': [0.5, 0.25], 'iteration': [2.0, 1.0]},
+                                            index=[('X1',), ('X1', 'X2')]))
+    storage.update_redundancies(pd.DataFrame({'redundancy': [0.75], 'iteration': [3.0]},
+                                             index=[(('X1',), 'X3')]))
+    redundancies = pd.DataFrame(np.inf, index=features, columns=features)
+    weights = pd.DataFrame(0, index=features, columns=features)
+    redundancies.loc['X1', 'X3'] = redundancies.loc['X3', 'X1'] = 0.75
+    weights.loc['X1', 'X3'] = weights.loc['X3', 'X1'] = 3
+    storage.update_bivariate_redundancies(redundancies, weights)
+    slices = ScoredSlices([], ['X1'])
+    slices.add_slices({'features': {'X1': {'from_value': [0, 1], 'to_value': [1, 2]}}, 'scores': [0.5, 0.75]})
+    storage.update_slices({('X1',): slices})
+    stored_redundancies, stored_weights = storage.get_bivariate_redundancies()
+    storage.close()
+
+    resumed = SQLiteResultStorage(path, features)
+    relevancies = resumed.get_relevancies()
+    self.assertTrue(relevancies.loc[[('X1', 'X2')], 'relevancy'].tolist() == [0.25])
+    self.assertTrue(relevancies.iteration.tolist() == [2.0, 1.0])
+    self.assertTrue(resumed.get_redundancies().redundancy.tolist() == [0.75])
+    bivariate_redundancies, bivariate_weights = resumed.get_bivariate_redundancies()
+    self.assertTrue((bivariate_redundancies.values == stored_redundancies.values).all())
+    self.assertTrue((bivariate_weights.values == stored_weights.values).all())
+    self.assertTrue(bivariate_redundancies.loc['X3', 'X1'] == 0.75 and bivariate_redundancies.loc['X1', 'X2'] == 0)
+    self.assertTrue(resumed.get_slices()[('X1',)].to_dict() == slices.to_dict())
+
+    # Only the changed subsets are written
+    other_slices = ScoredSlices([], ['X2'])
+    other_slices.add_slices({'features': {'X2': {'from_value': [0], 'to_value': [1]}}, 'scores': [0.25]})
+    current_slices = resumed.get_slices()
+    current_slices[('X2',)] = other_slices
+    resumed.update_slices(current_slices, changed=[('X2',)])
+    self.assertTrue(resumed.connection.execute('SELECT COUNT(*) FROM slices').fetchone()[0] == 2)
+    resumed.close()
+    reopened = SQLiteResultStorage(path, features)
+    self.assertTrue(reopened.get_slices()[('X2',)].to_dict() == other_slices.to_dict())
+    reopened.close()
+
+    with self.assertRaises(ValueError):
+      SQLiteResultStorage(path, features[:2])
+
+  def test_sqlite_without_pickle(self):
+    features = [1, 2]
+    path = os.path.join(tempfile.mkdtemp(), 'results.sqlite')
+
+    storage = SQLiteResultStorage(path, features)
+    class_scores = pd.DataFrame([[0.25, 0.75]], index=[0], columns=[0, 1])
+    storage.accumulate_relevancies(pd.DataFrame({'relevancy': [class_scores], 'iteration': [2.0]}, index=[(1,)]))
+    slices = ScoredSlices([{'name': 2, 'values': [3, 4]}], [1], 2, 0.1)
+    slices.add_slices({'features': {1: {'from_value': [0.5, 0], 'to_value': [1, 0.5]}, 2: [[1, 0], [0, 1]]},
+                       'scores': [1, 2]})
+    storage.update_slices({(1, 2): slices})
+    storage.close()
+
+    resumed = SQLiteResultStorage(path, features)
+    self.assertTrue(resumed.get_relevancies().relevancy[[(1,)]].iloc[0].equals(class_scores.astype(float)))
+    self.assertTrue(resumed.get_slices()[(1, 2)].to_dict() == slices.to_dict())
+    # Results of older versions were pickled, they are rejected instead of unpickled
+    resumed.connection.execute('UPDATE slices SET slices = ?', (pickle.dumps(slices.to_dict()),))
+    resumed.close()
+    with self.assertRaises(ValueError):
+      SQLiteResultStorage(path, features)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,7 +1,7 @@
 # Created by Marcus Pappik
 
 from unittest import TestCase
-from rar.hics.bivariate_correlation import ScoredSlices
+from hics.scored_slices import ScoredSlices
 import numpy as np
 import pandas as pd
 import json
@@ -27,11 +27,11 @@ class Test_scored_slices(TestCase):
     scored_slices.add_slices(slices)
     scored_slices.reduce_slices()
 
-    self.assertTrue(len(scored_slices.continuous.iloc[0].index) == 2)
-    self.assertTrue(np.all(np.array(scored_slices.continuous['X1', :, 'from_value']) == np.array([0, 0.5])))
-    self.assertTrue(np.all(np.array(scored_slices.continuous['X1', :, 'to_value']) == np.array([0.75, 1])))
-    self.assertTrue(np.all(np.array(scored_slices.continuous['X2', :, 'from_value']) == np.array([0, 0.5])))
-    self.assertTrue(np.all(np.array(scored_slices.continuous['X2', :, 'to_value']) == np.array([0.5, 1])))
+    self.assertTrue(len(scored_slices.scores) == 2)
+    self.assertTrue(np.all(np.array(scored_slices.continuous['X1']['from_value']) == np.array([0, 0.5])))
+    self.assertTrue(np.all(np.array(scored_slices.continuous['X1']['to_value']) == np.array([0.75, 1])))
+    self.assertTrue(np.all(np.array(scored_slices.continuous['X2']['from_value']) == np.array([0, 0.5])))
+    self.assertTrue(np.all(np.array(scored_slices.continuous['X2']['to_value']) == np.array([0.5, 1])))
     self.assertTrue(np.all(np.array(scored_slices.categorical['X3']) == np.array([[1, 0, 1, 0], [1, 1, 1, 0]])))
     self.assertTrue(np.all(np.array(scored_slices.categorical['X4']) == np.array([[0, 0, 1, 1], [1, 1, 1, 0]])))
 
@@ -39,31 +39,52 @@ class Test_scored_slices(TestCase):
     result = [{
               'deviation': 2.5,
               'features': {
-                  'ft_con_2': {'from': 8.0, 'to': 9.0},
-                  'ft_con_1': {'from': 2.0, 'to': 3.0},
-                  'ft_cat_2': ['1'],
-                  'ft_cat_1': ['a', 'b']}
+                  'ft_con_1': {'to_value': 3.0, 'from_value': 2.0},
+                  'ft_con_2': {'to_value': 9.0, 'from_value': 8.0},
+                  'ft_cat_1': [1.0, 2.0],
+                  'ft_cat_2': [1.0]}
               }]
     result_json = json.dumps(result)
 
-    ft_cat_1 = pd.DataFrame({'a': [1], 'b': [1]})
-    ft_cat_2 = pd.DataFrame({'1': [1], '2': [0]})
-    ft_con_1 = pd.DataFrame({'from': [2], 'to': [3]})
-    ft_con_2 = pd.DataFrame({'from': [8], 'to': [9]})
-    continuous = {'ft_con_1': ft_con_1, 'ft_con_2': ft_con_2}
-    categorical = {'ft_cat_1': ft_cat_1, 'ft_cat_2': ft_cat_2}
-    scores = pd.Series([2.5])
+    slices = {
+        'features': {
+            'ft_con_1': {'from_value': [2, 0], 'to_value': [3, 1]},
+            'ft_con_2': {'from_value': [8, 0], 'to_value': [9, 1]},
+            'ft_cat_1': [[1, 1, 0], [0, 0, 1]],
+            'ft_cat_2': [[1, 0], [1, 1]]},
+        'scores': [2.5, 0.5]
+    }
+    categorical = [{'name': 'ft_cat_1', 'values': [1, 2, 3]}, {'name': 'ft_cat_2', 'values': [1, 2]}]
 
-    scored_slices = ScoredSlices([], [], 2, 0.1)
-    scored_slices.continuous = continuous
-    scored_slices.categorical = categorical
-    scored_slices.scores = scores
+    scored_slices = ScoredSlices(categorical, ['ft_con_1', 'ft_con_2'], 1, 0.1)
+    scored_slices.add_slices(slices)
+    scored_slices.reduce_slices()
 
     output = scored_slices.to_output()
     output_json = json.dumps(output)
 
     self.assertTrue(result_json == output_json)
 
+  def test_dict_round_trip(self):
+    slices = {
+        'features': {'X1': {'from_value': [0.5, 0], 'to_value': [1, 0.5]}, 'X2': [[1, 0], [0, 1]]},
+        'scores': [1, 2]
+    }
+    scored_slices = ScoredSlices([{'name': 'X2', 'values': ['a', 'b']}], ['X1'], 2, 0.1)
+    scored_slices.add_slices(slices)
+
+    dictionary = scored_slices.to_dict()
+    self.assertTrue(dictionary['scores'] == [2, 1])
+    self.assertTrue(dictionary['categorical']['X2'] == {'a': [0, 1], 'b': [1, 0]})
+    self.assertTrue(ScoredSlices.from_dict(json.loads(json.dumps(dictionary))).to_dict() == dictionary)
+
+  def test_max_candidates(self):
+    scored_slices = ScoredSlices([], ['X1'], 2, 0.1, max_candidates=3)
+    for score in [0.2, 0.9, 0.1, 0.5, 0.7]:
+      scored_slices.add_slices({'features': {'X1': {'from_value': [score], 'to_value': [1]}}, 'scores': [score]})
+
+    self.assertTrue(scored_slices.scores.tolist() == [0.9, 0.7, 0.5])
+    self.assertTrue(scored_slices.continuous['X1']['from_value'].tolist() == [0.9, 0.7, 0.5])
 
 if __name__ == '__main__':
   unittest.main()
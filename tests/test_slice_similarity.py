@@ -1,11 +1,81 @@
 # Created by Marcus Pappik
 
 from unittest import TestCase
-from rar.hics.slice_similarity import continuous_similarity_matrix, categorical_similarity_matrix
+from hics.slice_similarity import continuous_similarity_matrix, categorical_similarity_matrix, \
+  continuous_similarities, categorical_similarities
 import numpy as np
 import pandas as pd
 
 
+def reference_continuous_similarity_matrix(dfs):
+  # Previous element-wise implementation of continuous_similarity_matrix
+  if dfs:
+    length = len(list(dfs.values())[0])
+  else:
+    length = 0
+
+  volumn = np.zeros((length, length))
+  overlap = np.zeros((length, length))
+
+  for index, df in dfs.items():
+    end = np.array([df['to_value']] * length)
+    start = np.array([df['from_value']] * length)
+    min_range = np.minimum((end - start), (end - start).T)
+    min_overlap_range = np.minimum((end.T - start), (end.T - start).T)
+
+    if not overlap.any():
+      overlap = np.minimum(min_range, min_overlap_range)
+    else:
+      overlap = overlap * np.minimum(min_range, min_overlap_range)
+    overlap[overlap < 0] = 0
+
+    if not volumn.any():
+      volumn = end - start
+    else:
+      volumn = volumn * (end - start)
+
+  min_volumn = np.maximum(volumn, volumn.T)
+
+  min_volumn[min_volumn <= 0] = 1
+  overlap[overlap < 0] = 0
+
+  return overlap / min_volumn
+
+
+def reference_categorical_similarity_matrix(dfs):
+  # Previous element-wise implementation of categorical_similarity_matrix
+  if dfs:
+    length = len(list(dfs.values())[0])
+  else:
+    length = 0
+
+  volumn = np.zeros((length, length))
+  overlap = np.zeros((length, length))
+
+  for index, df in dfs.items():
+
+    data_array = np.array([np.array(df).tolist()] * len(df))
+    size_array = np.apply_along_axis(lambda x: (x * 1).sum(), 2, data_array)
+
+    current_overlap = np.apply_along_axis(lambda x: (x * 1).sum(), 2,
+                                          np.logical_and(data_array, data_array.transpose(1, 0, 2)))
+
+    if not overlap.any():
+      overlap = current_overlap
+    else:
+      overlap = overlap * current_overlap
+
+    if not volumn.any():
+      volumn = size_array
+    else:
+      volumn = volumn * size_array
+
+  min_volumn = np.minimum(volumn, volumn.T)
+  min_volumn[min_volumn == 0] = 1
+
+  return overlap / min_volumn
+
+
 class Test_slice_similarity(TestCase):
   def test_categorical(self):
     result = np.array([[1, 0.5, 0.5], [0.5, 1, 0.25], [0.5, 0.25, 1]])
@@ -18,6 +88,33 @@ class Test_slice_similarity(TestCase):
     similarity = categorical_similarity_matrix(categorical)
     self.assertTrue(np.all(similarity == result))
 
+  def test_categorical_equivalence(self):
+    random_state = np.random.RandomState(0)
+    for features, empty_rows in [(1, 0), (3, 0), (3, 40), (2, 60)]:
+      categorical = {}
+      for feature in range(features):
+        mask = (random_state.rand(60, random_state.randint(1, 6)) < 0.5).astype(int)
+        mask[:empty_rows] = 0
+        categorical[feature] = pd.DataFrame(mask)
+
+      expected = reference_categorical_similarity_matrix(categorical)
+      for block_size in [None, 7, 60]:
+        self.assertTrue(np.array_equal(categorical_similarity_matrix(categorical, block_size), expected))
+
+  def test_continuous_equivalence(self):
+    random_state = np.random.RandomState(0)
+    for features, empty_rows in [(1, 0), (3, 0), (3, 40), (2, 60)]:
+      continuous = {}
+      for feature in range(features):
+        from_values = random_state.rand(60)
+        to_values = from_values + random_state.rand(60) * 0.5
+        to_values[:empty_rows] = from_values[:empty_rows]
+        continuous[feature] = pd.DataFrame({'from_value': from_values, 'to_value': to_values})
+
+      expected = reference_continuous_similarity_matrix(continuous)
+      for block_size in [None, 7, 60]:
+        self.assertTrue(np.array_equal(continuous_similarity_matrix(continuous, block_size), expected))
+
   def test_continuous(self):
     result = np.array([[1, 0, 0], [0, 1, 2 / 3], [0, 2 / 3, 1]])
 
@@ -29,6 +126,27 @@ class Test_slice_similarity(TestCase):
     similarity = continuous_similarity_matrix(continuous)
     self.assertTrue(np.all(similarity == result))
 
+  def test_similarity_rows(self):
+    random_state = np.random.RandomState(0)
+    from_values = random_state.rand(20, 3)
+    to_values = from_values + random_state.rand(20, 3)
+    # Empty ranges and empty value sets make the matrix functions restart their products
+    to_values[:, 0] = from_values[:, 0]
+    masks = [random_state.rand(20, 4) < 0.5, random_state.rand(20, 3) < 0.5]
+    masks[0][:, :] = False
+
+    continuous = {i: pd.DataFrame({'from_value': from_values[:, i], 'to_value': to_values[:, i]}) for i in range(3)}
+    categorical = {i: pd.DataFrame(mask.astype(int)) for i, mask in enumerate(masks)}
+    continuous_matrix = continuous_similarity_matrix(continuous)
+    categorical_matrix = categorical_similarity_matrix(categorical)
+
+    candidates = np.arange(3, 20, 2)
+    for row in [0, 5]:
+      self.assertTrue(np.array_equal(continuous_similarities(from_values, to_values, row, candidates),
+                                     continuous_matrix[row, candidates]))
+      self.assertTrue(np.array_equal(categorical_similarities(masks, row, candidates),
+                                     categorical_matrix[row, candidates]))
+
 
 if __name__ == '__main__':
   unittest.main()
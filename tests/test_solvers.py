@@ -0,0 +1,61 @@
+from unittest import TestCase
+from wrar.solvers import QPSolver, subset_incidence
+from scipy.optimize import minimize
+import numpy as np
+import pandas as pd
+
+
+class Test_solvers(TestCase):
+  def test_qp_solver(self):
+    random_state = np.random.RandomState(0)
+    columns = ['a', 'b', 'c', 'd', 'e', 'f']
+    subsets = [('a',), ('b',), ('a', 'c'), ('b', 'd', 'e'), ('c', 'f'), ('d',), ('a', 'e', 'f'), ('e',)]
+    scores = pd.Series(random_state.rand(len(subsets)), index=pd.Index(subsets, tupleize_cols=False))
+
+    incidence = np.array([[col in subset for col in columns] for subset in subsets], dtype=float)
+    self.assertTrue(np.array_equal(subset_incidence(columns, subsets).toarray(), incidence))
+
+    solution = QPSolver().solve(subset_incidence(columns, subsets), scores.values, scores.max())
+
+    reference = minimize(lambda x: x.sum() + ((x - x.mean()) ** 2).sum(), np.full(len(columns), scores.max()),
+                         jac=lambda x: 1 + 2 * (x - x.mean()), method='SLSQP',
+                         bounds=[(0, scores.max())] * len(columns),
+                         constraints=[{'type': 'ineq', 'fun': lambda x: incidence @ x - scores.values,
+                                       'jac': lambda x: incidence}],
+                         options={'ftol': 1e-12}).x
+
+    self.assertTrue(np.allclose(solution, reference, atol=1e-5))
+    self.assertTrue(np.all(incidence @ solution >= scores.values - 1e-6))
+
+  def test_qp_iterations(self):
+    subsets = [('a',), ('a', 'b'), ('b', 'c')]
+    incidence = subset_incidence(['a', 'b', 'c'], subsets)
+    scores = np.array([0.5, 0.75, 0.25])
+
+    solver = QPSolver()
+    model = solver.build(incidence)
+    solver.resolve(model, scores, 1)
+    self.assertTrue(0 < model['iterations'] < solver.max_iter)
+
+    # Without iterations the clipped starting point is returned
+    solver = QPSolver(max_iter=0)
+    model = solver.build(incidence)
+    solution, _ = solver.resolve(model, scores, 1)
+    self.assertTrue(np.allclose(solution, 0.5) and model['iterations'] == 0)
+
+  def test_solve_classes(self):
+    random_state = np.random.RandomState(1)
+    subsets = [(i,) for i in range(8)] + [tuple(random_state.choice(8, 3, replace=False)) for _ in range(40)]
+    incidence = subset_incidence(list(range(8)), subsets)
+    class_scores = [random_state.rand(len(subsets)) * weight for weight in (1, 0.5, 2)]
+    uppers = [scores.max() for scores in class_scores]
+
+    expected = [QPSolver().solve(incidence, scores, upper) for scores, upper in zip(class_scores, uppers)]
+    for n_jobs in (1, 2):
+      solutions = QPSolver().solve_classes(incidence, class_scores, uppers, n_jobs=n_jobs)
+      for solution, reference in zip(solutions, expected):
+        self.assertTrue(np.allclose(solution, reference, atol=1e-5))
+
+
+if __name__ == '__main__':
+  unittest.main()
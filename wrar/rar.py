@@ -1,6 +1,7 @@
 # Created by Daniel Thevessen
 
-from hics.result_storage import DefaultResultStorage
+from hics.result_storage import DefaultResultStorage, SQLiteResultStorage
+from hics.result_shards import merge_shards, write_shard
 from hics.incremental_correlation import IncrementalCorrelation
 from wrar.rar_search import RaRSearch
 import numpy as np
@@ -8,12 +9,22 @@ import pandas as pd
 
 
 class RaR:
-  def __init__(self, data):
+  def __init__(self, data, contrast_cache=None):
     self.data = data
+    self.contrast_cache = contrast_cache
     self.correlation = None
     self.feature_ranking = None
 
-  def run(self, target, k=5, runs=None, split_iterations=3, cost_matrix=None, compensate_imbalance=False, weight_mod=1):
+  def append_rows(self, rows):
+    """Appends rows to the dataset, keeping the results of previous runs as weighted prior estimates
+    """
+    self.data = pd.concat([self.data, rows])
+    if self.correlation is not None:
+      self.correlation.append_rows(rows)
+
+  def run(self, target, k=5, runs=None, split_iterations=3, cost_matrix=None, compensate_imbalance=False, weight_mod=1,
+          n_jobs=1, seed=None, iterations=10, adaptive_tolerance=None, stopping=None,
+          solver=None, storage_path=None):
     # if cost_matrix:
     #     assert cost_matrix is pd.DataFrame and len(cost_matrix.index) == len(cost_matrix.columns), \
     #         'Cost matrix needs to be a square-form pandas.DataFrame!'
@@ -40,14 +51,63 @@ class RaR:
 
     if self.correlation is None or target != self.correlation.target:
         input_features = [ft for ft in self.data.columns.values if ft != target]
-        storage = DefaultResultStorage(input_features)
+        if storage_path is None:
+            storage = DefaultResultStorage(input_features)
+        else:
+            storage = SQLiteResultStorage(storage_path, input_features)
         self.correlation = IncrementalCorrelation(self.data, target, storage,
                                                   cost_matrix=(cost_matrix if compensate_imbalance else None),
-                                                  weight_mod=weight_mod)
+                                                  weight_mod=weight_mod, n_jobs=n_jobs, seed=seed,
+                                                  contrast_cache=self.contrast_cache, iterations=iterations,
+                                                  adaptive_tolerance=adaptive_tolerance)
+    else:
+        if storage_path is not None and getattr(self.correlation.result_storage, 'path', None) != storage_path:
+            raise ValueError('Results of {} are already stored elsewhere, storage_path only applies to the first '
+                             'run of a target'.format(target))
+        self.correlation.configure(n_jobs=n_jobs, seed=seed, iterations=iterations,
+                                   adaptive_tolerance=adaptive_tolerance)
 
     rar_search = RaRSearch(self.correlation, k=k, monte_carlo=runs,
-                           split_iterations=split_iterations, cost_matrix=cost_matrix)
-    self.feature_ranking = rar_search.select_features()
+                           split_iterations=split_iterations, cost_matrix=cost_matrix, stopping=stopping,
+                           solver=solver, solver_jobs=n_jobs)
+    # Worker processes of n_jobs > 1 are kept for all phases of the run
+    with self.correlation:
+      self.feature_ranking = rar_search.select_features()
 
     for (index, rank) in enumerate(self.feature_ranking):
         print('{}. {} with a score of {}'.format(index + 1, rank[0], rank[1]))
+
+  def sample_shard(self, target, path, k=5, runs=None, cost_matrix=None, n_jobs=1, seed=None, iterations=10,
+                   adaptive_tolerance=None):
+    """Worker part of a run split across machines: samples runs subsets (default: one per feature) and writes their
+    relevancies and slices to the shard file path, see hics.result_shards. Every worker needs its own seed, the
+    shards are combined by rank_shards
+    """
+    input_features = [ft for ft in self.data.columns.values if ft != target]
+    correlation = IncrementalCorrelation(self.data, target, DefaultResultStorage(input_features),
+                                         cost_matrix=cost_matrix, n_jobs=n_jobs, seed=seed,
+                                         contrast_cache=self.contrast_cache, iterations=iterations,
+                                         adaptive_tolerance=adaptive_tolerance)
+    with correlation:
+      correlation.update_multivariate_relevancies(k=k, runs=runs or len(correlation.features),
+                                                  cost_matrix=cost_matrix)
+    write_shard(correlation.result_storage, path)
+
+  def rank_shards(self, target, paths, k=5, split_iterations=3, cost_matrix=None, n_jobs=1, seed=None, iterations=10,
+                  solver=None):
+    """Merges the shards at paths (a list of files or a shared directory) and ranks the features on the merged
+    relevancies like run, without sampling further subsets. Redundancies are estimated on this machine
+    """
+    storage = merge_shards(paths)
+    self.correlation = IncrementalCorrelation(self.data, target, storage, cost_matrix=cost_matrix, n_jobs=n_jobs,
+                                              seed=seed, contrast_cache=self.contrast_cache, iterations=iterations)
+    if [str(ft) for ft in storage.features] != self.correlation.features:
+      raise ValueError('Shards were written for the features {}'.format(storage.features))
+
+    rar_search = RaRSearch(self.correlation, k=k, split_iterations=split_iterations, cost_matrix=cost_matrix,
+                           solver=solver, solver_jobs=n_jobs)
+    with self.correlation:
+      self.feature_ranking = rar_search.rank_features()
+
+    for (index, rank) in enumerate(self.feature_ranking):
+      print('{}. {} with a score of {}'.format(index + 1, rank[0], rank[1]))
@@ -5,16 +5,107 @@ from wrar.relevance_optimizer import RelevanceOptimizer
 import numpy as np
 import collections
 import sys
+import time
+
+
+def _feature_redundancy(correlation, candidates, feature, k, split_iterations):
+  # Redundancy of feature towards random splits of the already ranked candidates
+  shuffled = np.random.permutation(candidates)
+  splits = [shuffled[j:j + k] for j in range(0, len(shuffled), k)]
+
+  subset_redundancies = []
+  for split in splits[:split_iterations]:
+    subset_redundancies.append(correlation.subspace_contrast.calculate_contrast(split, feature))
+  return max(subset_redundancies)
+
+
+class RankingStability:
+  """Anytime stopping rule for RaRSearch.select_features. Relevance sampling runs in rounds of round_runs (default:
+  a quarter of the features), after every round the optimizer is solved again. The search stops once the ranking of
+  the top_k features agreed with the one of the previous round for patience consecutive rounds, or once max_runs
+  (default: ten times the features) or max_time seconds are exceeded. Rounds only count as agreeing once every
+  feature was part of at least min_samples sampled subsets and min_runs runs were done, features that were never
+  sampled apart share their relevance and would otherwise look stable.
+  Keyword arguments:
+  measure -- 'kendall' for Kendall's tau of the relevances of both rounds' top_k features, 'overlap' for the
+             share of top_k features in both rounds
+  threshold -- minimal tau or overlap for two rounds to agree
+  tie_tolerance -- relevances closer than this are tied, ties count as broken at random so that features the
+                   optimizer cannot tell apart lower the agreement
+  """
+
+  def __init__(self, round_runs=None, top_k=10, measure='kendall', threshold=0.9, patience=2, max_runs=None,
+               max_time=None, min_samples=1, min_runs=0, tie_tolerance=1e-6):
+    if measure not in ('kendall', 'overlap'):
+      raise ValueError('Unknown ranking stability measure {}'.format(measure))
+    self.round_runs = round_runs
+    self.top_k = top_k
+    self.measure = measure
+    self.threshold = threshold
+    self.patience = patience
+    self.max_runs = max_runs
+    self.max_time = max_time
+    self.min_samples = min_samples
+    self.min_runs = min_runs
+    self.tie_tolerance = tie_tolerance
+
+  def _top_probabilities(self, relevances):
+    # Probability of every feature to be among the top_k when ties are broken at random
+    values = sorted(relevances.values(), reverse=True)
+    cutoff = values[min(self.top_k, len(values)) - 1]
+    above = [f for f in relevances if relevances[f] > cutoff + self.tie_tolerance]
+    tied = [f for f in relevances if abs(relevances[f] - cutoff) <= self.tie_tolerance]
+    probabilities = {f: 1 for f in above}
+    probabilities.update({f: (min(self.top_k, len(values)) - len(above)) / len(tied) for f in tied})
+    return probabilities
+
+  def similarity(self, previous, current):
+    """Agreement of two {feature: relevance} rankings, expected over random tie breaking
+    """
+    previous_top, current_top = self._top_probabilities(previous), self._top_probabilities(current)
+    if self.measure == 'overlap':
+      shared = sum(p * current_top.get(f, 0) for f, p in previous_top.items())
+      return shared / min(self.top_k, len(current))
+
+    def order(relevances, a, b):
+      difference = relevances[a] - relevances[b]
+      return 0 if abs(difference) <= self.tie_tolerance else np.sign(difference)
+
+    # Kendall's tau-a, a pair tied in either round agrees as often as it disagrees
+    features = sorted(set(previous_top).union(current_top))
+    if len(features) < 2:
+      return 1
+    pairs = [(a, b) for i, a in enumerate(features) for b in features[i + 1:]]
+    return sum(order(previous, a, b) * order(current, a, b) for a, b in pairs) / len(pairs)
+
+  def sampled(self, subsets, features, runs):
+    """Whether the sampled subsets cover every feature min_samples times and at least min_runs runs were done
+    """
+    if runs < self.min_runs:
+      return False
+    samples = collections.Counter(feature for subset in subsets for feature in subset)
+    return all(samples[feature] >= self.min_samples for feature in features)
 
 
 class RaRSearch(RelevanceOptimizer):
 
-  def __init__(self, correlation, k=5, monte_carlo=None, split_iterations=3, cost_matrix=None):
+  def __init__(self, correlation, k=5, monte_carlo=None, split_iterations=3, cost_matrix=None, stopping=None,
+               solver=None, solver_jobs=1):
+    """Keyword arguments:
+    monte_carlo -- function of the number of features returning the relevance runs, see monte_carlo_fixed
+    stopping -- optional RankingStability, runs relevance sampling in rounds until the ranking is stable instead
+    solver -- optional wrar.solvers.RelevanceSolver, default: Gurobi if installed, otherwise QPSolver
+    solver_jobs -- number of threads solving the per-class problems of a cost matrix concurrently
+    """
     self.correlation = correlation
     self.k = k
     self.split_iterations = split_iterations
     self.monte_carlo = monte_carlo
     self.cost_matrix = cost_matrix
+    self.stopping = stopping
+    self.runs_used = 0
+    self.solver = solver
+    self.solver_jobs = solver_jobs
     if monte_carlo is None:
       # Estimate for how many runs are necessary for good relevance "coverage"
       n = len(correlation.features)
@@ -26,26 +117,71 @@ class RaRSearch(RelevanceOptimizer):
     return _mc_fixed
 
   def _nCr(n, k):
-    factorial(n) // factorial(k) // factorial(n - k)
+    return factorial(n) // factorial(k) // factorial(n - k)
 
-  def monte_carlo_adaptive(runs, m, beta, min):
+  def monte_carlo_adaptive(k, m, beta, min):
+    """Runs such that every set of m features is contained in a random k-subset with probability 1 - beta
+    """
     def _mc_adaptive(dim):
-      n = ceil(log(beta) / log(1 - _nCr(dim - m, k - m) / _nCr(dim, k)))
+      k_dim = RaRSearch._nCr(dim, k) if k <= dim else 1
+      covered = RaRSearch._nCr(dim - m, k - m) / k_dim if m <= k <= dim else 1
+      if covered >= 1:
+        return min
+      n = ceil(log(beta) / log(1 - covered))
       return max(n, min)
     return _mc_adaptive
 
   def select_features(self):
     dim = len(self.correlation.features)
 
-    self.correlation.update_multivariate_relevancies(k=self.k, runs=self.monte_carlo(dim), cost_matrix=self.cost_matrix)
+    if self.stopping is not None:
+      return self._calculate_ranking(self._sample_until_stable(dim))
+
+    self.runs_used = self.monte_carlo(dim)
+    self.correlation.update_multivariate_relevancies(k=self.k, runs=self.runs_used, cost_matrix=self.cost_matrix)
+    return self._calculate_ranking()
+
+  def rank_features(self):
+    """Ranks the features on the relevancies already stored in the correlation, e.g. merged from shards
+    """
     return self._calculate_ranking()
 
-  def _calculate_ranking(self):
-    print('Running optimizer...')
-    feature_relevances = self._calculate_single_feature_relevance(self.correlation.features,
-                                                                  self.correlation.result_storage.relevancies.relevancy,
-                                                                  self.cost_matrix)
-    print('Optimizer done.')
+  def _solve_relevances(self):
+    return self._calculate_single_feature_relevance(self.correlation.features,
+                                                    self.correlation.result_storage.relevancies.relevancy,
+                                                    self.cost_matrix)
+
+  def _sample_until_stable(self, dim):
+    """Anytime relevance sampling, see RankingStability. Returns the single feature relevances of the last round
+    """
+    round_runs = self.stopping.round_runs or ceil(dim / 4)
+    max_runs = self.stopping.max_runs or 10 * dim
+    start = time.time()
+
+    stable_rounds = 0
+    previous = None
+    self.runs_used = 0
+    while True:
+      self.correlation.update_multivariate_relevancies(k=self.k, runs=round_runs, cost_matrix=self.cost_matrix)
+      self.runs_used += round_runs
+
+      current = self._solve_relevances()
+      if previous is not None and self.stopping.sampled(self.correlation.result_storage.relevancies.index,
+                                                        self.correlation.features, self.runs_used):
+        stable = self.stopping.similarity(previous, current) >= self.stopping.threshold
+        stable_rounds = stable_rounds + 1 if stable else 0
+      previous = current
+
+      out_of_time = self.stopping.max_time is not None and time.time() - start >= self.stopping.max_time
+      if stable_rounds >= self.stopping.patience or self.runs_used >= max_runs or out_of_time:
+        print('\rRelevance: stopped after {} runs'.format(self.runs_used))
+        return current
+
+  def _calculate_ranking(self, feature_relevances=None):
+    if feature_relevances is None:
+      print('Running optimizer...')
+      feature_relevances = self._solve_relevances()
+      print('Optimizer done.')
     # print(feature_relevances)
     feature_redundancies = self._calculate_redundancies(self.correlation.features, feature_relevances)
 
@@ -63,18 +199,16 @@ class RaRSearch(RelevanceOptimizer):
     sorted_features = sorted(features, key=lambda f: relevances[f])
 
     redundancies = {sorted_features[0]: 0}
-    for i in range(1, len(sorted_features)):
+    # Every feature only depends on the features ranked before it, so all of them can be estimated independently
+    arguments = [(sorted_features[:i], sorted_features[i], self.k, self.split_iterations)
+                 for i in range(1, len(sorted_features))]
+    results = self.correlation.map_runs(_feature_redundancy, arguments)
+    for i, redundancy in enumerate(results, start=1):
       # Progress Counter
       sys.stdout.write('\rRedundancy: {:.2f}%     '.format(100 * i / len(sorted_features)))
       sys.stdout.flush()
 
-      shuffled = np.random.permutation(sorted_features[:i])
-      splits = [shuffled[j:j + self.k] for j in range(0, len(shuffled), self.k)]
-
-      subset_redundancies = []
-      for split in splits[:self.split_iterations]:
-        subset_redundancies.append(self.correlation.subspace_contrast.calculate_contrast(split, sorted_features[i]))
-      redundancies[sorted_features[i]] = max(subset_redundancies)
+      redundancies[sorted_features[i]] = redundancy
     print('\rRedundancy: 100.00%')
     return redundancies
 
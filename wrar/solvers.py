@@ -0,0 +1,224 @@
+import importlib.util
+import itertools
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.linalg import cho_factor, cho_solve
+from concurrent.futures import ThreadPoolExecutor
+
+
+def subset_incidence(columns, subsets):
+  """Sparse (subsets x columns) CSR matrix with a 1 for every feature in a subset
+  """
+  lengths = np.fromiter(map(len, subsets), dtype=np.int64, count=len(subsets))
+  features = pd.Index(columns).get_indexer(list(itertools.chain.from_iterable(subsets)))
+  indptr = np.concatenate([[0], np.cumsum(lengths)])
+  return sp.csr_matrix((np.ones(len(features)), features, indptr), shape=(len(subsets), len(columns)))
+
+
+class RelevanceSolver:
+  """Backend of RelevanceOptimizer. Solves the single feature relevance problem
+      minimize sum(x) + sum((x - mean(x)) ** 2)
+      subject to incidence @ x >= scores, 0 <= x <= upper
+  with one row of the incidence matrix per sampled subset, see subset_incidence. Backends implement build and
+  resolve, so that problems differing only in scores and upper (the classes of cost-sensitive RaR) share a model
+  """
+
+  def build(self, incidence):
+    """Model of the constraint structure, reused by every resolve with this incidence
+    """
+    raise NotImplementedError()
+
+  def resolve(self, model, scores, upper, warm_start=None):
+    """Solves model for the given right-hand sides, returns the optimal x (in the order of the incidence columns)
+    and a warm start for the next resolve
+    """
+    raise NotImplementedError()
+
+  def solve(self, incidence, scores, upper):
+    solution, _ = self.resolve(self.build(incidence), scores, upper)
+    return solution
+
+  def solve_classes(self, incidence, class_scores, uppers, n_jobs=1):
+    """Solves the problem for every score vector and bound in class_scores and uppers. The first problem is solved
+    from scratch, the following ones are warm-started from the previous solution, or with n_jobs > 1 solved
+    concurrently in threads with their own models, warm-started from the first solution
+    """
+    model = self.build(incidence)
+    solution, warm_start = self.resolve(model, class_scores[0], uppers[0])
+    solutions = [solution]
+
+    if n_jobs == 1:
+      for scores, upper in zip(class_scores[1:], uppers[1:]):
+        solution, warm_start = self.resolve(model, scores, upper, warm_start)
+        solutions.append(solution)
+      return solutions
+
+    thread_models = threading.local()
+
+    def resolve_class(scores, upper):
+      if not hasattr(thread_models, 'model'):
+        thread_models.model = self.build(incidence)
+      solution, _ = self.resolve(thread_models.model, scores, upper, warm_start)
+      return solution
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+      solutions += list(executor.map(resolve_class, class_scores[1:], uppers[1:]))
+    return solutions
+
+
+class GurobiSolver(RelevanceSolver):
+  """Solves the relevance problem with the Gurobi Optimizer (requires gurobipy and a license). Gurobi environments
+  are not thread-safe, so every thread building models gets its own environment
+  """
+
+  def __init__(self):
+    # Imported here, so that wrar can be used without gurobipy
+    import gurobipy
+    self.gb = gurobipy
+    self.envs = threading.local()
+
+  def _env(self):
+    if not hasattr(self.envs, 'env'):
+      env = self.gb.Env(empty=True)
+      env.setParam('OutputFlag', 0)
+      env.start()
+      self.envs.env = env
+    return self.envs.env
+
+  def build(self, incidence):
+    gb = self.gb
+    n = incidence.shape[1]
+    m = gb.Model('rar', env=self._env())
+
+    # x and a free variable mean, sum((x - mean) ** 2) is smallest for the mean of x. So the objective
+    # sum(x) + x'x - 2 * mean * sum(x) + n * mean ** 2 has a sparse Q instead of the dense centering matrix
+    x = m.addMVar(n + 1, lb=np.append(np.zeros(n), -gb.GRB.INFINITY), name='x')
+    ones = sp.csr_matrix(np.ones((n, 1)))
+    Q = sp.bmat([[sp.identity(n), -ones], [-ones.T, sp.csr_matrix([[n]])]], format='csr')
+    m.setMObjective(Q, np.append(np.ones(n), 0), 0, xQ_L=x, xQ_R=x, xc=x, sense=gb.GRB.MINIMIZE)
+    constraints = m.addMConstr(sp.hstack([incidence, sp.csr_matrix((incidence.shape[0], 1))], format='csr'), x,
+                               gb.GRB.GREATER_EQUAL, np.zeros(incidence.shape[0]))
+    return m, x, constraints
+
+  def resolve(self, model, scores, upper, warm_start=None):
+    m, x, constraints = model
+    x.UB = np.append(np.full(x.shape[0] - 1, upper), self.gb.GRB.INFINITY)
+    constraints.RHS = scores
+    if warm_start is not None:
+      x.PStart = warm_start
+
+    m.optimize()
+    return x.X[:-1], x.X
+
+
+class QPSolver(RelevanceSolver):
+  """Dependency-light solver for the relevance problem, a primal-dual interior point method with Mehrotra's
+  predictor-corrector steps on
+      minimize 1/2 x'Px + q'x  subject to  Gx >= h
+  with P the centering matrix, q = 1 and G the subset/feature incidence stacked onto the bounds. Every iteration
+  solves one n x n system, so the cost is linear in the number of subsets and typically 15-30 iterations are needed.
+  Warm starts move the previous primal and dual solution slightly into the interior.
+  Keyword arguments:
+  tolerance -- relative tolerance of the residuals and the duality gap
+  max_iter -- iteration limit, the last iterate is returned if it is reached
+  The iterations of the last resolve of a model are kept in model['iterations'].
+  """
+
+  def __init__(self, tolerance=1e-8, max_iter=100):
+    self.tolerance = tolerance
+    self.max_iter = max_iter
+
+  def build(self, incidence):
+    incidence = incidence.tocsr()
+    m, n = incidence.shape
+    # Rows of G: the subsets, x >= 0 and -x >= -upper
+    G = sp.vstack([incidence, sp.identity(n), -sp.identity(n)], format='csr')
+
+    # Feature pairs of every subset, so that the n x n matrix incidence'W incidence is a single bincount
+    lengths = np.diff(incidence.indptr)
+    squares = lengths ** 2
+    pair_rows = np.repeat(np.arange(m), squares)
+    within = np.arange(squares.sum()) - np.repeat(np.cumsum(squares) - squares, squares)
+    row_lengths = np.repeat(lengths, squares)
+    row_starts = np.repeat(incidence.indptr[:-1], squares)
+    pair_index = incidence.indices[row_starts + within // row_lengths] * n + \
+        incidence.indices[row_starts + within % row_lengths]
+
+    return {'shape': (m, n), 'G': G, 'GT': G.T.tocsr(), 'P': 2 * (np.eye(n) - 1 / n), 'pair_rows': pair_rows,
+            'pair_index': pair_index}
+
+  def resolve(self, model, scores, upper, warm_start=None):
+    G, GT, P = model['G'], model['GT'], model['P']
+    m, n = model['shape']
+    q = np.ones(n)
+    h = np.concatenate([scores, np.zeros(n), np.full(n, -upper)])
+
+    if warm_start is None:
+      x = np.full(n, upper / 2)
+      s = np.maximum(G @ x - h, 1)
+      z = np.ones(len(h))
+    else:
+      x, z = warm_start
+      x = np.clip(x, 0.01 * upper, 0.99 * upper)
+      s = np.maximum(G @ x - h, 0.01)
+      z = np.maximum(z, 0.01)
+    scale_p = 1 + np.abs(h).max()
+    scale_d = 1 + np.abs(q).max()
+
+    for iteration in range(self.max_iter):
+      residual_d = P @ x + q - GT @ z
+      residual_p = G @ x - s - h
+      mu = s @ z / len(h)
+      if np.abs(residual_p).max() <= self.tolerance * scale_p and \
+         np.abs(residual_d).max() <= self.tolerance * scale_d and mu <= self.tolerance:
+        break
+
+      weights = z / s
+      # G'WG, the bound rows only add to the diagonal
+      reduced = np.bincount(model['pair_index'], weights=weights[model['pair_rows']], minlength=n * n)
+      reduced = reduced.reshape(n, n)
+      reduced[np.diag_indices(n)] += weights[m:m + n] + weights[m + n:]
+      factor = cho_factor(P + reduced + 1e-12 * np.eye(n))
+
+      def newton_step(complementarity):
+        dx = cho_solve(factor, -residual_d - GT @ ((complementarity + z * residual_p) / s))
+        ds = G @ dx + residual_p
+        dz = -(complementarity + z * ds) / s
+        return dx, ds, dz
+
+      # Predictor (affine scaling) step, then the centered and corrected step
+      dx, ds, dz = newton_step(s * z)
+      alpha = min(_step_length(s, ds), _step_length(z, dz))
+      mu_affine = (s + alpha * ds) @ (z + alpha * dz) / len(h)
+      sigma = (mu_affine / mu) ** 3
+
+      dx, ds, dz = newton_step(s * z + ds * dz - sigma * mu)
+      alpha = min(1, 0.99 * min(_step_length(s, ds), _step_length(z, dz)))
+      x = x + alpha * dx
+      s = s + alpha * ds
+      z = z + alpha * dz
+    else:
+      iteration = self.max_iter
+
+    # Kept per model, concurrent resolves of solve_classes each use their own
+    model['iterations'] = iteration
+    return np.clip(x, 0, upper), (x, z)
+
+
+def _step_length(values, steps):
+  """Largest step in (0, 1] keeping values + step * steps non-negative
+  """
+  negative = steps < 0
+  if not negative.any():
+    return 1
+  return min(1, (-values[negative] / steps[negative]).min())
+
+
+def default_solver():
+  """Gurobi if gurobipy is installed, otherwise the built-in QPSolver
+  """
+  if importlib.util.find_spec('gurobipy') is not None:
+    return GurobiSolver()
+  return QPSolver()